@@ -0,0 +1,199 @@
+"""
+Выполнение запросов из командной строки.
+
+Запросы читаются из файлов (или stdin) и разделяются ';', все запросы
+выполняются в одном процессе, поэтому пулы соединений и кэши метаданных
+используются повторно. Результаты пишутся в stdout (CSV, JSON lines или Arrow IPC stream),
+время выполнения и ошибки - в stderr. Поддерживаются команды
+USE <имя> AS <псевдоним> и EXIT.
+
+    python -m multidb queries.sql
+    python -m multidb -e 'SELECT ...' --format jsonl --stats
+    python -m multidb < queries.sql
+
+Если stdin - терминал, запросы вводятся интерактивно
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from . import export
+from .main import ControlCenter
+from .result import ResultCursor
+
+
+def split_queries(text):
+    """
+    Разбивает текст на запросы по ';' вне строк и идентификаторов в кавычках,
+    комментарии -- удаляются. Последний элемент - текст после последней ';'.
+    Как и в лексере (token.StringToken), символ после \\ в кавычках экранирован
+    """
+    queries = []
+    current = []
+    quote = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote is not None:
+            if char == '\\' and i + 1 < len(text):
+                current.append(text[i:i + 2])
+                i += 2
+                continue
+            if char == quote:
+                quote = None
+        elif char in ('\'', '"'):
+            quote = char
+        elif text.startswith('--', i):
+            end = text.find('\n', i)
+            i = len(text) if end == -1 else end
+            continue
+        elif char == ';':
+            queries.append(''.join(current))
+            current = []
+            i += 1
+            continue
+        current.append(char)
+        i += 1
+    queries.append(''.join(current))
+    return queries
+
+
+class Runner:
+    def __init__(self, cc: ControlCenter, fmt=export.CSV, batch_size=ResultCursor.DEFAULT_BATCH_SIZE,
+                 timeout=None, stats=False, out=None, err=None):
+        self.cc = cc
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.stats = stats
+        self.out = out or sys.stdout.buffer
+        self.err = err or sys.stderr
+        self.failed = 0
+        self.finished = False
+        # Один контекст на все запросы
+        self.ctx = cc.session()
+
+    def run(self, query):
+        """
+        Выполняет один запрос или команду, результат пишется в out
+        """
+        if not query.strip():
+            return
+        if self.cc.EXIT_REGEXP.match(query):
+            self.finished = True
+            return
+        try:
+            if self.cc.use(query):
+                return
+        except ValueError as ex:
+            return self._error(str(ex))
+
+        start = time.perf_counter()
+        err, data = self.cc.execute(query, self.ctx, self.batch_size, self.timeout)
+        if err:
+            return self._error(err)
+        result = data[-1]
+        try:
+            writer = export.STREAM_WRITERS[self.fmt](self.out, result.header, result.types)
+            for rows in result.batches():
+                writer.write(rows)
+            writer.close()
+            self.out.flush()
+        finally:
+            result.close()
+        self.err.write('-- {} rows, {:.3f} s\n'.format(result.row_count, time.perf_counter() - start))
+        if self.stats:
+            for stage, total in result.profile.summary().items():
+                self.err.write('--   {:<16} {:.3f} s{}\n'.format(
+                    stage,
+                    total['duration'],
+                    '' if total['rows'] is None else ', {} rows'.format(total['rows'])
+                ))
+        self.err.flush()
+
+    def run_text(self, text):
+        for query in split_queries(text):
+            if self.finished:
+                return
+            self.run(query)
+
+    def interactive(self, stdin):
+        """
+        Построчный ввод, запрос выполняется после ';' или команды EXIT
+        """
+        buffer = ''
+        while not self.finished:
+            self.err.write('multidb> ' if not buffer.strip() else '      -> ')
+            self.err.flush()
+            line = stdin.readline()
+            if not line:
+                break
+            buffer += line
+            *queries, buffer = split_queries(buffer)
+            for query in queries:
+                self.run(query)
+            if self.cc.EXIT_REGEXP.match(buffer) or self.cc.USE_REGEXP.match(buffer):
+                self.run(buffer)
+                buffer = ''
+        if buffer.strip() and not self.finished:
+            self.run(buffer)
+
+    def _error(self, message):
+        self.failed += 1
+        self.err.write('ERROR: {}\n'.format(message))
+        self.err.flush()
+
+    def close(self):
+        self.ctx.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        prog='python -m multidb',
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    arg_parser.add_argument('files', nargs='*', help='файлы с запросами, - для stdin')
+    arg_parser.add_argument('-e', '--execute', action='append', default=[], help='текст запроса')
+    arg_parser.add_argument('--config', default=os.environ.get('MULTIDB_CONFIG', 'config.yaml'))
+    arg_parser.add_argument('--format', choices=list(export.STREAM_WRITERS), default=export.CSV)
+    arg_parser.add_argument('--batch-size', type=int, default=ResultCursor.DEFAULT_BATCH_SIZE)
+    arg_parser.add_argument('--timeout', type=float, help='ограничение времени запроса, сек.')
+    arg_parser.add_argument('--stats', action='store_true', help='профиль каждого запроса в stderr')
+    args = arg_parser.parse_args(argv)
+
+    # Журнал не должен смешиваться с результатами в stdout
+    loggers = [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        for handler in getattr(logger, 'handlers', []):
+            if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+                handler.setStream(sys.stderr)
+
+    cc = ControlCenter(args.config)
+    runner = Runner(cc, args.format, args.batch_size, args.timeout, args.stats)
+    try:
+        for query in args.execute:
+            runner.run_text(query)
+        files = args.files or ([] if args.execute else ['-'])
+        for path in files:
+            if runner.finished:
+                break
+            if path == '-' and sys.stdin.isatty():
+                runner.interactive(sys.stdin)
+            elif path == '-':
+                runner.run_text(sys.stdin.read())
+            else:
+                with open(path, encoding='utf-8') as f:
+                    runner.run_text(f.read())
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        runner.close()
+        cc.close()
+    return 1 if runner.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,8 @@ import os
 
 import yaml
 
+from . import context
+
 CURRENT_DIR = os.path.dirname(__file__)
 
 
@@ -22,44 +24,64 @@ def setup_logging(
 
 
 class ParserLogger(logging.Logger):
-    is_crashed = False
-    parser = None
+    """
+    Состояние логгера (ошибки, буферы, текущий парсер)
+    хранится в контексте выполнения запроса
+    """
     log_position = True
-    buffer = []
-    errors = []
 
     # -1 not log pos
     #  0 last token
     #  1 current token
     default_mod = 0
-    mode = default_mod
 
     def __init__(self, name, level=logging.NOTSET):
         super().__init__(name, level)
         self.log_position = False
 
+    @property
+    def is_crashed(self):
+        return context.current().is_crashed
+
+    @property
+    def errors(self):
+        return context.current().errors
+
+    @property
+    def buffer(self):
+        return context.current().buffer
+
+    @property
+    def parser(self):
+        return context.current().parser
+
+    @property
+    def mode(self):
+        return context.current().log_mode
+
     @classmethod
     def pop_line_buffer(cls, dev=None):
-        if cls.buffer:
-            data = cls.buffer.pop()
+        buffer = context.current().buffer
+        if buffer:
+            data = buffer.pop()
             if dev:
-                if cls.buffer:
-                    cls.buffer[-1].extend(data)
+                if buffer:
+                    buffer[-1].extend(data)
                 else:
                     for slf, *args in data:
                         logging.Logger._log(slf, *args)
 
     @classmethod
     def append_line_buffer(cls, data=None):
-        cls.buffer.append(data or [])
+        context.current().buffer.append(data or [])
 
     @classmethod
     def set_is_crashed(cls, is_crashed):
-        cls.is_crashed = is_crashed
+        context.current().is_crashed = is_crashed
 
     @classmethod
     def set_parser(cls, parser):
-        cls.parser = parser
+        context.current().parser = parser
 
     def display_position(self):
         self.log_position = True
@@ -71,30 +93,31 @@ class ParserLogger(logging.Logger):
 
     @property
     def current_token(self):
-        self.__class__.mode = 1
+        context.current().log_mode = 1
         return self
 
     @property
     def pass_token_info(self):
-        self.__class__.mode = -1
+        context.current().log_mode = -1
         return self
 
     def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False):
-        lexer = self.parser.token
+        ctx = context.current()
+        lexer = ctx.parser and ctx.parser.token
 
         if level >= logging.ERROR:
-            self.__class__.is_crashed = True
+            ctx.is_crashed = True
 
-        if self.log_position and self.mode >= 0 and lexer:
-            pos = lexer.interval if self.mode else lexer.last_interval
+        if self.log_position and ctx.log_mode >= 0 and lexer:
+            pos = lexer.interval if ctx.log_mode else lexer.last_interval
             msg = '{!r} {}'.format(pos, msg)
-        self.__class__.mode = self.default_mod
+        ctx.log_mode = self.default_mod
 
-        if self.__class__.buffer:
-            self.__class__.buffer[-1].append((self, level, msg, args, exc_info, extra, stack_info))
+        if ctx.buffer:
+            ctx.buffer[-1].append((self, level, msg, args, exc_info, extra, stack_info))
         else:
             if level >= logging.ERROR:
-                self.__class__.errors.append(msg % args)
+                ctx.errors.append(msg % args)
             super()._log(level, msg, args, exc_info, extra, stack_info)
 
 
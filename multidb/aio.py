@@ -0,0 +1,193 @@
+"""
+asyncio интерфейс к ControlCenter.
+
+Блокирующие вызовы pyodbc и sqlite3 выполняются в ограниченном пуле потоков,
+выгрузка таблиц из источников идет параллельно. При отмене задачи
+выполняемые на источниках запросы прерываются через cursor.cancel()
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from . import dml
+from .result import ResultCursor
+
+
+class AsyncRows:
+    """
+    Асинхронный итератор по строкам ResultCursor
+    """
+
+    def __init__(self, acc, result: ResultCursor):
+        self.acc = acc
+        self.result = result
+        self._batch = []
+
+    @property
+    def header(self):
+        return self.result.header
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._batch:
+            self._batch = await self.acc.run(self.result.fetchmany)
+            if not self._batch:
+                raise StopAsyncIteration
+            self._batch.reverse()
+        return self._batch.pop()
+
+    async def batches(self):
+        while True:
+            rows = await self.acc.run(self.result.fetchmany)
+            if not rows:
+                return
+            yield rows
+
+    async def close(self):
+        self._batch = []
+        await self.acc.run(self.result.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncControlCenter:
+    def __init__(self, cc, max_workers=None):
+        self.cc = cc  # ControlCenter
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='multidb')
+
+    async def run(self, func, *args):
+        """
+        Выполняет блокирующую функцию в пуле потоков
+        с сохранением текущего контекста запроса
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, func, *args)
+
+    async def execute(self, query, ctx=None, batch_size=ResultCursor.DEFAULT_BATCH_SIZE, timeout=None):
+        """
+        Асинхронный аналог ControlCenter.execute.
+        Результат возвращается в виде AsyncRows
+        """
+        own_context = ctx is None
+        ctx = ctx or self.cc.session()
+        ctx.begin(timeout or self.cc.query_timeout)
+        success = False
+        try:
+            with ctx:
+                err, data = await self._execute(query, ctx, batch_size, own_context)
+            success = err is None
+            return err, data
+        finally:
+            ctx.finish()
+            if not success and own_context:
+                await self.run(ctx.close)
+
+    async def _execute(self, query, ctx, batch_size, own_context):
+        cc = self.cc
+        prepare = asyncio.ensure_future(self.run(cc._prepare, query, ctx))
+        try:
+            err, select, view_sql = await asyncio.shield(prepare)
+        except asyncio.CancelledError:
+            # Разбор продолжает использовать соединения контекста,
+            # поэтому перед освобождением дожидаемся его завершения
+            await self._abort(ctx, [prepare])
+            raise
+        if err:
+            await self.run(ctx.release)
+            return err, None
+
+        if isinstance(select, (dml.Explain, dml.MaterializedView)):
+            # План и материализованное представление строятся
+            # последовательно в одном потоке
+            try:
+                err, data = await asyncio.shield(self.run(cc._run, ctx, select, view_sql, batch_size, own_context))
+            except asyncio.CancelledError:
+                ctx.cancel()
+                raise
+            finally:
+                await self.run(ctx.release)
+            if err:
+                return err, None
+            *queries, result = data
+            return None, (*queries, AsyncRows(self, result))
+
+        ctx.reconnect()
+        tables = select.tables
+        extracts = []
+        try:
+            create_queries = [
+                await self.run(cc._create_table, ctx, table)
+                for table in tables
+            ]
+            select_queries = [
+                table.select_query.get_sql()
+                for table in tables
+            ]
+            insert_queries = [
+                table.insert_query
+                for table in tables
+            ]
+            extracts = [
+                asyncio.ensure_future(self._extract(table, select_query))
+                for table, select_query in zip(tables, select_queries)
+            ]
+            # Таблицы загружаются в SQLite по мере завершения выгрузки,
+            # большие таблицы загружаются порциями во время выгрузки
+            for extract in asyncio.as_completed(extracts):
+                table, rows = await extract
+                if rows is not None:
+                    await self.run(cc._load, ctx, table, rows)
+                    await self.run(cc._save_extract, ctx, table)
+
+            view_sql = await self.run(cc._view_sql, select, view_sql)
+            view_query = await self.run(cc._create_view, ctx, view_sql)
+        except asyncio.CancelledError:
+            await self._abort(ctx, extracts)
+            raise
+        except Exception as ex:
+            await self._abort(ctx, extracts)
+            return str(ctx.cancelled or ex), None
+        finally:
+            await self.run(ctx.release)
+
+        rows = AsyncRows(self, cc._result(ctx, select, batch_size, own_context))
+        return None, (create_queries, select_queries, insert_queries, view_query, rows)
+
+    async def _extract(self, table, select_query):
+        if table.watermark is not None:
+            await self.run(self.cc._refresh, table.context, table)
+            return table, None
+        if await self.run(self.cc._load_extract, table.context, table):
+            return table, None
+        if await self.run(lambda: table.streaming):
+            await self.run(self.cc._stream, table.context, table, select_query)
+            await self.run(self.cc._save_extract, table.context, table)
+            return table, None
+        rows = await self.run(self.cc._extract, table, select_query)
+        return table, rows
+
+    @staticmethod
+    async def _abort(ctx, extracts):
+        """
+        Прерывает незавершенные выгрузки и дожидается освобождения курсоров,
+        после чего соединения можно вернуть в пул
+        """
+        if not all(extract.done() for extract in extracts):
+            ctx.cancel()
+        if extracts:
+            await asyncio.gather(*extracts, return_exceptions=True)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
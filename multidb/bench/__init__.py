@@ -0,0 +1,69 @@
+"""
+Бенчмарки multidb.
+
+Запуск: python -m multidb.bench.<name>
+"""
+import json
+import math
+import time
+
+
+def measure(func, repeat, warmup=1):
+    """
+    Время выполнения func для каждого из repeat запусков, в секундах
+    """
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def percentile(data, q):
+    data = sorted(data)
+    if not data:
+        return None
+    k = (len(data) - 1) * q / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return data[lo] + (data[hi] - data[lo]) * (k - lo)
+
+
+def summarize(name, timings, items=1):
+    """
+    Задержки (p50, p95, p99) и пропускная способность (items в секунду)
+    """
+    total = sum(timings)
+    return {
+        'name': name,
+        'runs': len(timings),
+        'mean': total / len(timings),
+        'p50': percentile(timings, 50),
+        'p95': percentile(timings, 95),
+        'p99': percentile(timings, 99),
+        'throughput': items * len(timings) / total if total else None,
+    }
+
+
+def format_table(rows):
+    header = '{:<36} {:>6} {:>11} {:>11} {:>11} {:>13}'.format(
+        'benchmark', 'runs', 'p50, ms', 'p95, ms', 'p99, ms', 'items/s'
+    )
+    lines = [header, '-' * len(header)]
+    for row in rows:
+        lines.append('{:<36} {:>6} {:>11.3f} {:>11.3f} {:>11.3f} {:>13.1f}'.format(
+            row['name'],
+            row['runs'],
+            row['p50'] * 1000,
+            row['p95'] * 1000,
+            row['p99'] * 1000,
+            row['throughput'] or 0,
+        ))
+    return '\n'.join(lines)
+
+
+def dump(rows, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, indent=2)
@@ -0,0 +1,170 @@
+"""
+Бенчмарки этапов выполнения запроса на синтетических локальных источниках:
+
+    lexer    - разбиение запроса на токены (items/s - токены в секунду)
+    parse    - SQLParser.program
+    execute  - ControlCenter.execute целиком (items/s - строки результата
+               в секунду) и его этапы из профиля запроса: validate, pdnf,
+               catalog, remote_execute, fetch, sqlite_insert, ...
+
+Результаты можно сохранить как эталон и сравнить с ним последующие запуски:
+
+    python -m multidb.bench --rows 10000 --save baseline.json
+    python -m multidb.bench --rows 10000 --compare baseline.json
+
+При сравнении код возврата 1, если медиана какого-либо
+бенчмарка выросла больше чем на --threshold
+"""
+import argparse
+import json
+import sys
+import time
+
+from . import dump, format_table, measure, summarize
+from . import sources
+from .. import lexer
+from .. import token as tk
+from ..parser import SQLParser
+
+BENCHMARKS = ('lexer', 'parse', 'execute')
+
+
+def tokenize(query):
+    lex = lexer.Lexer(lexer.Position(query))
+    count = 0
+    while lex.parse()[0].kind != tk.BaseToken.END:
+        count += 1
+    return count
+
+
+def bench_lexer(args, query):
+    tokens = tokenize(query)
+    timings = measure(lambda: tokenize(query), args.repeat, args.warmup)
+    return [summarize('lexer', timings, tokens)]
+
+
+def bench_parse(args, query):
+    timings = measure(lambda: SQLParser.build(query).program(), args.repeat, args.warmup)
+    return [summarize('parse', timings)]
+
+
+def bench_execute(args, query, cc):
+    timings = []
+    stages = {}
+    row_count = 0
+    for i in range(args.warmup + args.repeat):
+        start = time.perf_counter()
+        err, data = cc.execute(query)
+        if err:
+            raise RuntimeError(err)
+        result = data[-1]
+        with result:
+            for _ in result.batches():
+                pass
+        elapsed = time.perf_counter() - start
+        if i < args.warmup:
+            continue
+        row_count = result.row_count
+        profile = result.profile
+        timings.append(elapsed)
+        for name, data in profile.summary().items():
+            stages.setdefault(name, []).append(data['duration'])
+    return [summarize('execute', timings, row_count)] + [
+        summarize('execute: {}'.format(name), durations)
+        for name, durations in stages.items()
+    ]
+
+
+def compare(rows, baseline, threshold):
+    """
+    Сравнение медиан с эталоном, возвращает список регрессий
+    """
+    old = {row['name']: row for row in baseline['results']}
+    lines = []
+    regressions = []
+    for row in rows:
+        base = old.get(row['name'])
+        if base is None or not base['p50']:
+            continue
+        ratio = row['p50'] / base['p50']
+        lines.append('{:<36} {:>11.3f} {:>11.3f} {:>+9.1%}'.format(
+            row['name'], base['p50'] * 1000, row['p50'] * 1000, ratio - 1
+        ))
+        if ratio > 1 + threshold:
+            regressions.append(row['name'])
+    print('{:<36} {:>11} {:>11} {:>9}'.format('benchmark', 'base, ms', 'p50, ms', 'change'))
+    print('\n'.join(lines))
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        prog='python -m multidb.bench',
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    arg_parser.add_argument(
+        'benchmarks',
+        nargs='*',
+        metavar='benchmark',
+        help='{} (default: all)'.format(', '.join(BENCHMARKS))
+    )
+    arg_parser.add_argument('--tables', type=int, default=2, help='number of joined tables')
+    arg_parser.add_argument('--rows', type=int, default=1000, help='rows per table')
+    arg_parser.add_argument('--columns', type=int, default=10, help='columns per table')
+    arg_parser.add_argument('--selectivity', type=float, default=1.0, help='share of joined rows')
+    arg_parser.add_argument('--predicates', type=int, default=2, help='conditions in WHERE')
+    arg_parser.add_argument('--repeat', type=int, default=20)
+    arg_parser.add_argument('--warmup', type=int, default=2)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--save', metavar='PATH', help='save results as baseline')
+    arg_parser.add_argument('--compare', metavar='PATH', help='compare results with baseline')
+    arg_parser.add_argument('--threshold', type=float, default=0.1, help='allowed p50 regression')
+    args = arg_parser.parse_args(argv)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        arg_parser.error('unknown benchmark: {} (choose from {})'.format(', '.join(unknown), ', '.join(BENCHMARKS)))
+    if args.selectivity <= 0:
+        arg_parser.error('--selectivity must be positive')
+    benchmarks = args.benchmarks or BENCHMARKS
+
+    params = {
+        key: getattr(args, key)
+        for key in ('tables', 'rows', 'columns', 'selectivity', 'predicates', 'repeat', 'seed')
+    }
+    query = sources.make_query(args.tables, args.columns, args.predicates)
+
+    rows = []
+    if 'lexer' in benchmarks:
+        rows += bench_lexer(args, query)
+    if 'parse' in benchmarks:
+        rows += bench_parse(args, query)
+    if 'execute' in benchmarks:
+        with sources.temp_dir() as path:
+            sources.make_tables(path, args.tables, args.rows, args.columns, args.selectivity, args.seed)
+            cc = sources.make_control_center(path)
+            try:
+                rows += bench_execute(args, query, cc)
+            finally:
+                cc.close()
+
+    print(format_table(rows))
+
+    if args.save:
+        dump({'params': params, 'results': rows}, args.save)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['params'] != params:
+            print('\nWarning: baseline parameters differ: {}'.format(baseline['params']))
+        print()
+        regressions = compare(rows, baseline, args.threshold)
+        if regressions:
+            print('\nRegressions: {}'.format(', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
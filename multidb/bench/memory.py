@@ -0,0 +1,85 @@
+"""
+Память, выделяемая лексером и парсером на один запрос (tracemalloc):
+
+    blocks     - количество выделенных блоков памяти, живых после разбора
+                 (для lexer - список всех токенов, для parse - дерево разбора)
+    per token  - blocks на один токен запроса
+    retained   - объем этих блоков, KiB
+    peak       - пиковый объем за время разбора, KiB
+
+    python -m multidb.bench.memory --columns 20 --joins 3 --predicates 10
+"""
+import argparse
+import gc
+import tracemalloc
+
+from .sources import make_query
+from .. import lexer
+from .. import token as tk
+from ..parser import SQLParser
+
+
+def tokenize(query):
+    lex = lexer.Lexer(lexer.Position(query))
+    tokens = []
+    while True:
+        current = lex.parse()
+        if current[0].kind == tk.BaseToken.END:
+            return tokens
+        tokens.append(current)
+
+
+def parse(query):
+    return SQLParser.build(query).program()
+
+
+def trace(func, query):
+    """
+    Результат func(query) и статистика выделенной памяти,
+    результат остается живым на момент снимка
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func(query)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    stats = snapshot.statistics('filename')
+    return result, {
+        'blocks': sum(stat.count for stat in stats),
+        'retained': sum(stat.size for stat in stats),
+        'peak': peak,
+    }
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--columns', type=int, default=10)
+    arg_parser.add_argument('--joins', type=int, default=2)
+    arg_parser.add_argument('--predicates', type=int, default=4)
+    args = arg_parser.parse_args(argv)
+
+    query = make_query(args.joins + 1, args.columns, args.predicates)
+    # Первый разбор заполняет кэши модулей (регулярные выражения и т.п.)
+    parse(query)
+
+    tokens = len(tokenize(query))
+
+    header = '{:<10} {:>10} {:>10} {:>14} {:>12}'.format('benchmark', 'blocks', 'per token', 'retained, KiB', 'peak, KiB')
+    print(header)
+    print('-' * len(header))
+    for name, func in (('lexer', tokenize), ('parse', parse)):
+        _, stats = trace(func, query)
+        print('{:<10} {:>10} {:>10.1f} {:>14.1f} {:>12.1f}'.format(
+            name,
+            stats['blocks'],
+            stats['blocks'] / tokens,
+            stats['retained'] / 1024,
+            stats['peak'] / 1024,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Скорость разбора запросов SQLParser с выключенной и включенной
+трассировкой правил (utils.log, переменная окружения MULTIDB_TRACE).
+
+Трассировка включается при импорте, поэтому каждый режим
+измеряется в отдельном процессе. С трассировкой логгер tree получает
+уровень DEBUG и NullHandler: записи журнала создаются и передаются
+обработчику, но никуда не выводятся, поэтому измеряется стоимость
+трассировки без вывода:
+
+    python -m multidb.bench.parse --repeat 200 --columns 20 --joins 3
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from . import format_table, measure, summarize
+from .sources import make_query
+
+
+def run_child(args):
+    from ..parser import SQLParser, tree_logger
+
+    trace = os.getenv('MULTIDB_TRACE') == '1'
+    if trace:
+        # При уровне WARNING (logging.yaml) декоратор utils.log
+        # не создает записей, и трассировка ничего не стоит
+        tree_logger.setLevel(logging.DEBUG)
+        tree_logger.handlers = [logging.NullHandler()]
+        tree_logger.propagate = False
+
+    query = make_query(args.joins + 1, args.columns, args.predicates)
+
+    def parse():
+        SQLParser.build(query).program()
+
+    timings = measure(parse, args.repeat, args.warmup)
+    mode = 'trace on: tree DEBUG, null' if trace else 'trace off'
+    print(json.dumps(summarize('parse ({})'.format(mode), timings)))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--repeat', type=int, default=100)
+    arg_parser.add_argument('--warmup', type=int, default=5)
+    arg_parser.add_argument('--columns', type=int, default=10)
+    arg_parser.add_argument('--joins', type=int, default=2)
+    arg_parser.add_argument('--predicates', type=int, default=4)
+    arg_parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+
+    if args.child:
+        return run_child(args)
+
+    rows = []
+    for trace in ('0', '1'):
+        env = dict(os.environ, MULTIDB_TRACE=trace)
+        out = subprocess.run(
+            [sys.executable, '-m', 'multidb.bench.parse', '--child'] + (argv if argv is not None else sys.argv[1:]),
+            env=env,
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        ).stdout
+        rows.append(json.loads(out.strip().splitlines()[-1]))
+    print(format_table(rows))
+    off, on = rows
+    print('\ntrace on: logger tree at DEBUG with NullHandler (records are created, nothing is written)')
+    print('trace off / trace on throughput: {:.2f}x'.format(off['throughput'] / on['throughput']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Локальные источники для бенчмарков.
+
+Каждая синтетическая таблица t<i> хранится в отдельном файле
+(база данных db<i>) источника типа sqlite, поэтому выполнение запроса
+проходит те же этапы, что и с настоящими источниками,
+но без сети и без ODBC драйверов
+"""
+import os
+import random
+import sqlite3
+import tempfile
+
+import yaml
+
+from ..main import ControlCenter
+
+SOURCE = 'bench'
+SCHEMA = 'main'
+
+
+def db_path(path, db):
+    return os.path.join(path, '{}.sqlite'.format(db))
+
+
+def column_type(i):
+    return ('integer', 'varchar', 'float')[i % 3]
+
+
+def make_tables(path, tables=2, rows=1000, columns=10, selectivity=1.0, seed=0):
+    """
+    Создает tables таблиц по rows строк и columns колонок (c0, c1, ...)
+    кроме ключей id и k.
+    Таблица t<i+1> соединяется с t<i> по условию t<i>.id = t<i+1>.k,
+    доля строк t<i+1>, для которых найдется пара, равна selectivity
+    """
+    if selectivity <= 0:
+        raise ValueError('selectivity must be positive: {}'.format(selectivity))
+    rnd = random.Random(seed)
+    key_range = max(1, int(rows / selectivity))
+    for i in range(tables):
+        conn = sqlite3.connect(db_path(path, 'db{}'.format(i)))
+        conn.execute('DROP TABLE IF EXISTS t{}'.format(i))
+        conn.execute('CREATE TABLE t{} (id integer primary key, k integer not null, {})'.format(
+            i,
+            ', '.join('c{} {}'.format(j, column_type(j)) for j in range(columns))
+        ))
+        values = (
+            [row, rnd.randrange(key_range)] + [
+                rnd.randrange(rows) if kind == 'integer' else
+                'value {}'.format(rnd.randrange(100)) if kind == 'varchar' else
+                rnd.random()
+                for j in range(columns)
+                for kind in [column_type(j)]
+            ]
+            for row in range(rows)
+        )
+        with conn:
+            conn.executemany(
+                'INSERT INTO t{} VALUES ({})'.format(i, ', '.join(['?'] * (columns + 2))),
+                values
+            )
+        conn.close()
+
+
+def make_query(tables=2, columns=10, predicates=1, source=SOURCE):
+    """
+    Запрос ко всем таблицам make_tables: все колонки в списке выборки,
+    INNER JOIN по ключам и predicates условий по целочисленным колонкам
+    """
+    names = ['t{}'.format(i) for i in range(tables)]
+    select_list = ', '.join(
+        '{}.c{}'.format(name, j)
+        for name in names
+        for j in range(columns)
+    )
+    sql = 'SELECT {} FROM {}.db0.{}.t0 AS t0'.format(select_list, source, SCHEMA)
+    for i, (prev, name) in enumerate(zip(names, names[1:]), 1):
+        sql += ' INNER JOIN {}.db{}.{}.{} AS {} ON {}.id = {}.k'.format(source, i, SCHEMA, name, name, prev, name)
+    int_columns = [j for j in range(columns) if column_type(j) == 'integer']
+    if predicates and int_columns:
+        sql += ' WHERE ' + ' AND '.join(
+            '({}.c{} >= {} OR {}.c{} < 0)'.format(name, j, i, name, j)
+            for i in range(predicates)
+            for name in [names[i % tables]]
+            for j in [int_columns[i % len(int_columns)]]
+        )
+    return sql
+
+
+def make_control_center(path):
+    """
+    ControlCenter с единственным источником bench, файлы баз данных в path.
+    Вызывающий закрывает его (ControlCenter.close)
+    """
+    config = os.path.join(path, 'config.yaml')
+    with open(config, 'w', encoding='utf-8') as f:
+        yaml.safe_dump({SOURCE: {'type': 'sqlite', 'path': path}}, f)
+    return ControlCenter(config)
+
+
+def temp_dir():
+    return tempfile.TemporaryDirectory(prefix='multidb_bench_')
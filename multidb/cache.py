@@ -0,0 +1,411 @@
+"""
+Локальный кэш таблиц источников (SQLite).
+
+Для таблиц с настроенным водяным знаком (монотонно растущая колонка,
+например id или updated_at) в кэше хранится копия всех колонок таблицы.
+При очередном запросе из источника выгружаются только строки со значением
+водяного знака больше сохраненного, после чего данные для запроса
+берутся из кэша с применением фильтров таблицы.
+
+Настройка источника:
+
+    psql:
+      ...
+      incremental:
+        shop.public.events: id               # только добавление строк
+        shop.public.orders:                  # строки изменяются,
+          column: updated_at                 # новая версия строки
+          key: id                            # заменяет старую по ключу
+
+Здесь же хранятся материализованные представления (dml.MaterializedView):
+таблица с результатом запроса под именем представления и запись
+в multidb_materialized с текстом запроса для обновления.
+
+Если задан срок хранения (настройка extract_ttl), то в кэш сохраняются
+и обычные выгрузки таблиц. Новая выгрузка берется из сохраненной, если та
+содержит все нужные колонки и ее фильтры - часть фильтров новой выгрузки,
+оставшиеся фильтры применяются локально
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+import pypika as pk
+
+from . import encoding
+from . import expression as expr
+from . import profiling
+from .profiling import Profile
+
+ATTACH_NAME = 'multidb_cache'
+
+
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class Watermark:
+    def __init__(self, column, key=None):
+        self.column = column
+        self.key = key
+
+    @classmethod
+    def from_config(cls, data):
+        if isinstance(data, dict):
+            return cls(data['column'], data.get('key'))
+        return cls(data)
+
+    def __repr__(self):
+        return 'Watermark({}, key={})'.format(self.column, self.key)
+
+
+class StagingCache:
+    logger = logging.getLogger('cache')
+
+    SQL_CREATE_WATERMARKS = (
+        'CREATE TABLE IF NOT EXISTS multidb_watermarks ('
+        'name varchar PRIMARY KEY, '
+        'columns varchar, '
+        'value)'
+    )
+    SQL_CREATE_MATERIALIZED = (
+        'CREATE TABLE IF NOT EXISTS multidb_materialized ('
+        'name varchar PRIMARY KEY, '
+        'query varchar, '
+        'refresh_every integer, '
+        'refreshed_at real)'
+    )
+    SQL_CREATE_EXTRACTS = (
+        'CREATE TABLE IF NOT EXISTS multidb_extracts ('
+        'name varchar PRIMARY KEY, '
+        'source varchar, '
+        'columns varchar, '
+        'filters varchar, '
+        'created_at real)'
+    )
+
+    def __init__(self, path=None):
+        # Без пути кэш - временный файл, удаляемый в close. База в памяти
+        # с общим кэшем (cache=shared) не подходит: при параллельных запросах
+        # ее блокировки таблиц (SQLITE_LOCKED) не ждут освобождения
+        self._temp_path = None
+        if not path:
+            fd, path = tempfile.mkstemp(prefix='multidb_cache_', suffix='.sqlite')
+            os.close(fd)
+            self._temp_path = path
+        self.uri = 'file:{}'.format(path)
+        self.conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        # Чтение из кэша не блокирует его обновление
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(self.SQL_CREATE_WATERMARKS)
+        self.conn.execute(self.SQL_CREATE_MATERIALIZED)
+        self.conn.execute(self.SQL_CREATE_EXTRACTS)
+        self.conn.commit()
+        # Временный файл удаляется и без явного close: при сборке объекта
+        # или при завершении интерпретатора
+        self._finalizer = weakref.finalize(self, _close, self.conn, self._temp_path)
+
+        self._lock = threading.Lock()
+        # Блокировки таблиц кэша: name -> Lock
+        self._locks = {}
+
+    def lock(self, name):
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    @staticmethod
+    def table_name(table):
+        return '.'.join(table.full_name())
+
+    def refresh(self, table, watermark: Watermark, batch_size):
+        """
+        Дополняет копию таблицы строками, добавленными в источник
+        после предыдущего обновления. Вызывается под self.lock(name)
+        """
+        ctx = table.context
+        name = self.table_name(table)
+        columns = [column for column in table.columns if column.supported]
+        signature = ','.join('{} {}'.format(column.name, column.type) for column in columns)
+
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT columns, value FROM multidb_watermarks WHERE name = ?',
+                (name,)
+            ).fetchone()
+            if row is None or row[0] != signature:
+                # Новая таблица или изменилась структура таблицы в источнике
+                self.logger.info('Create cache table %s', name)
+                with self.conn:
+                    self.conn.execute('DROP TABLE IF EXISTS {}'.format(quote(name)))
+                    self.conn.execute('CREATE TABLE {} ({})'.format(
+                        quote(name),
+                        ', '.join('{} {}'.format(quote(column.name), column.type) for column in columns)
+                    ))
+                    if watermark.key:
+                        self.conn.execute('CREATE UNIQUE INDEX {} ON {} ({})'.format(
+                            quote(name + '.key'), quote(name), quote(watermark.key)
+                        ))
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO multidb_watermarks VALUES (?, ?, NULL)',
+                        (name, signature)
+                    )
+                value = None
+            else:
+                value = row[1]
+
+        field = pk.Field(watermark.column)
+        query = table._table.select(*[pk.Field(column.name) for column in columns])
+        if value is not None:
+            query = query.where(field > value)
+        select_query = query.get_sql()
+
+        insert = '{} INTO {} VALUES ({})'.format(
+            'INSERT OR REPLACE' if watermark.key else 'INSERT',
+            quote(name),
+            ', '.join(['?'] * len(columns))
+        )
+        idx = [column.name for column in columns].index(watermark.column)
+
+        ctx.check()
+        with ctx.profile.stage(Profile.EXECUTE, table.source_name):
+            cursor = table.cursor
+            cursor.execute(select_query)
+        fetch = ctx.profile.begin(Profile.FETCH, table.source_name)
+        insert_stage = ctx.profile.begin(Profile.CACHE, table.source_name)
+        while True:
+            ctx.check()
+            with profiling.StageTimer(fetch):
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            fetch.add_rows(len(rows), ctx.profile.size(rows))
+            batch_max = max((row[idx] for row in rows if row[idx] is not None), default=None)
+            with profiling.StageTimer(insert_stage), self._lock, self.conn:
+                self.conn.executemany(insert, rows)
+                if batch_max is not None and (value is None or batch_max > value):
+                    value = batch_max
+                    # Водяной знак сохраняется в той же транзакции, что и строки
+                    self.conn.execute(
+                        'UPDATE multidb_watermarks SET value = ? WHERE name = ?',
+                        (value, name)
+                    )
+            insert_stage.add_rows(len(rows))
+        return select_query
+
+    def load(self, ctx, table, name=None):
+        """
+        Загружает данные для запроса из копии таблицы
+        (или сохраненной выгрузки name) в SQLite контекста
+        """
+        name = name or self.table_name(table)
+        source = pk.Table(name, pk.Schema(ATTACH_NAME))
+        query = pk.SQLLiteQuery.from_(source).select(*[
+            pk.Field(column.name)
+            for column in table.selected_columns
+        ])
+        for f in table.filters:
+            query = query.where(f.pika())
+        sql = 'INSERT INTO {} {}'.format(table.sqlite_table.get_sql(), query.get_sql())
+        with ctx.profile.stage(Profile.INSERT, table.source_name), ctx.sqlite_lock:
+            self.attach(ctx.sqlite_conn)
+            with ctx.sqlite_conn:
+                ctx.sqlite_conn.execute(sql)
+            ctx.check_memory()
+        return sql
+
+    @classmethod
+    def _conditions(cls, expression):
+        """
+        Условия, соединенные через AND. Внешний IS TRUE отбрасывается,
+        для фильтра строк условие с ним и без него эквивалентны
+        """
+        if isinstance(expression, expr.And):
+            for arg in expression.args:
+                yield from cls._conditions(arg)
+        elif isinstance(expression, expr.Is) and expression.right is True:
+            yield from cls._conditions(expression.left)
+        else:
+            yield str(expression.pika())
+
+    @classmethod
+    def _filters(cls, table):
+        return {condition for f in table.filters for condition in cls._conditions(f)}
+
+    def find_extract(self, table, ttl):
+        """
+        Сохраненная не ранее ttl секунд назад выгрузка, из которой можно
+        получить выгрузку table: все нужные колонки есть, фильтры - подмножество
+        фильтров table. Из подходящих выбирается выгрузка с наибольшим числом фильтров
+        """
+        columns = {column.name for column in table.selected_columns}
+        filters = self._filters(table)
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT name, columns, filters FROM multidb_extracts WHERE source = ? AND created_at >= ?',
+                (table.source_name, time.time() - ttl)
+            ).fetchall()
+
+        found = None
+        found_filters = -1
+        for name, cached_columns, cached_filters in rows:
+            cached_columns = set(json.loads(cached_columns))
+            cached_filters = set(json.loads(cached_filters))
+            if not columns <= cached_columns or not cached_filters <= filters:
+                continue
+            # Оставшиеся фильтры применяются к сохраненной выгрузке,
+            # поэтому их колонки тоже должны в ней быть
+            extra = filters - cached_filters
+            if any(
+                quote(name) in f
+                for name in table.name_to_column.names()
+                if name not in cached_columns
+                for f in extra
+            ):
+                continue
+            if len(cached_filters) > found_filters:
+                found, found_filters = name, len(cached_filters)
+        return found
+
+    def load_extract(self, ctx, table, ttl):
+        """
+        Загружает таблицу из подходящей сохраненной выгрузки (find_extract).
+        Возвращает запрос загрузки или None, если такой выгрузки нет
+        """
+        name = self.find_extract(table, ttl)
+        if name is None:
+            return None
+        with self.lock(name):
+            with self._lock:
+                exists = self.conn.execute('SELECT 1 FROM multidb_extracts WHERE name = ?', (name,)).fetchone()
+            if not exists:
+                # Удалена по истечении срока хранения
+                return None
+            self.logger.info('Table %s loaded from extract %s', table.source_name, name)
+            return self.load(ctx, table, name)
+
+    def save_extract(self, ctx, table, ttl):
+        """
+        Сохраняет выгрузку таблицы, загруженную в SQLite контекста,
+        и удаляет выгрузки старше ttl секунд
+        """
+        name = 'extract.{}'.format(uuid.uuid4().hex)
+        target = '{}.{}'.format(ATTACH_NAME, quote(name))
+        # Запись в кэш из соединения контекста - под self._lock, как и через self.conn:
+        # в кэш одновременно пишет только одно соединение
+        with ctx.profile.stage(Profile.CACHE, table.source_name) as stage, ctx.sqlite_lock, self._lock:
+            self.attach(ctx.sqlite_conn)
+            with ctx.sqlite_conn:
+                ctx.sqlite_conn.execute('BEGIN')
+                ctx.sqlite_conn.execute('CREATE TABLE {} ({})'.format(
+                    target,
+                    ', '.join('{} {}'.format(quote(column.name), column.type) for column in table.selected_columns)
+                ))
+                rows = ctx.sqlite_conn.execute('INSERT INTO {} SELECT {} FROM {}'.format(
+                    target,
+                    ', '.join(
+                        encoding.decode_sql(quote(column.name)) if column.encoded else quote(column.name)
+                        for column in table.selected_columns
+                    ),
+                    table.sqlite_table.get_sql()
+                )).rowcount
+                ctx.sqlite_conn.execute(
+                    'INSERT INTO {}.multidb_extracts VALUES (?, ?, ?, ?, ?)'.format(ATTACH_NAME),
+                    (
+                        name,
+                        table.source_name,
+                        json.dumps([column.name for column in table.selected_columns]),
+                        json.dumps(sorted(self._filters(table))),
+                        time.time(),
+                    )
+                )
+            stage.add_rows(rows)
+        self.purge_extracts(ttl)
+
+    def purge_extracts(self, ttl):
+        with self._lock:
+            expired = [
+                name
+                for name, in self.conn.execute(
+                    'SELECT name FROM multidb_extracts WHERE created_at < ?',
+                    (time.time() - ttl,)
+                )
+            ]
+        for name in expired:
+            with self.lock(name), self._lock, self.conn:
+                self.conn.execute('BEGIN')
+                self.conn.execute('DROP TABLE IF EXISTS {}'.format(quote(name)))
+                self.conn.execute('DELETE FROM multidb_extracts WHERE name = ?', (name,))
+            with self._lock:
+                self._locks.pop(name, None)
+
+    def materialized(self):
+        """
+        Материализованные представления: name -> (query, refresh_every)
+        """
+        with self._lock:
+            return {
+                name: (query, refresh_every)
+                for name, query, refresh_every in self.conn.execute(
+                    'SELECT name, query, refresh_every FROM multidb_materialized'
+                )
+            }
+
+    def materialize(self, ctx, name, query, refresh_every, names):
+        """
+        Сохраняет результат запроса (представление result контекста)
+        в таблицу name с колонками names (dml.Select.result_names).
+        Старое содержимое заменяется в той же транзакции,
+        поэтому читающие запросы видят либо предыдущий, либо новый результат.
+        Вызывается под self.lock(name)
+        """
+        target = '{}.{}'.format(ATTACH_NAME, quote(name))
+        with ctx.profile.stage(Profile.CACHE) as stage, ctx.sqlite_lock, self._lock:
+            self.attach(ctx.sqlite_conn)
+            # Из представления берутся только типы: его колонки названы внутренними именами
+            types = [dtype for dtype, in ctx.sqlite_conn.execute("SELECT type FROM pragma_table_info('result')")]
+            with ctx.sqlite_conn:
+                # DDL не начинает транзакцию неявно
+                ctx.sqlite_conn.execute('BEGIN')
+                ctx.sqlite_conn.execute('DROP TABLE IF EXISTS {}'.format(target))
+                ctx.sqlite_conn.execute('CREATE TABLE {} ({})'.format(
+                    target,
+                    ', '.join('{} {}'.format(quote(column), dtype) for column, dtype in zip(names, types))
+                ))
+                rows = ctx.sqlite_conn.execute('INSERT INTO {} SELECT * FROM result'.format(target)).rowcount
+                ctx.sqlite_conn.execute(
+                    'INSERT OR REPLACE INTO {}.multidb_materialized VALUES (?, ?, ?, ?)'.format(ATTACH_NAME),
+                    (name, query, refresh_every, time.time())
+                )
+            stage.add_rows(rows)
+        self.logger.info('Materialized view %s: %s rows', name, rows)
+
+    def drop_materialized(self, name):
+        with self._lock, self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.execute('DROP TABLE IF EXISTS {}'.format(quote(name)))
+            self.conn.execute('DELETE FROM multidb_materialized WHERE name = ?', (name,))
+
+    def attach(self, conn):
+        attached = {name for _, name, _ in conn.execute('PRAGMA database_list')}
+        if ATTACH_NAME not in attached:
+            conn.execute('ATTACH DATABASE ? AS {}'.format(ATTACH_NAME), (self.uri,))
+
+    def close(self):
+        self._finalizer()
+
+
+def _close(conn, temp_path):
+    conn.close()
+    if temp_path:
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(temp_path + suffix)
+            except FileNotFoundError:
+                pass
+
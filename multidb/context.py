@@ -0,0 +1,239 @@
+"""
+Контекст выполнения запроса.
+
+Всё изменяемое состояние, которое раньше хранилось в атрибутах классов
+(ошибки ParserLogger, флаг генерации SQL для SQLite, счетчик таблиц,
+отступ трассировки, соединение с SQLite), хранится в объекте QueryContext.
+Текущий контекст передается через contextvars, поэтому каждый поток
+и каждая asyncio задача работают со своим контекстом.
+"""
+import contextvars
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+
+from .exceptions import QueryCancelled, QueryTimeout
+from .profiling import Profile
+
+
+class QueryContext:
+    logger = logging.getLogger('context')
+
+    def __init__(self, cc=None):
+        self.cc = cc  # ControlCenter
+
+        # Состояние ParserLogger
+        self.is_crashed = False
+        self.errors = []
+        self.buffer = []
+        self.parser = None
+        self.log_mode = 0
+
+        # Отступ для utils.log
+        self.log_size = 0
+
+        # Генерация SQL для SQLite
+        self.is_sqlite = False
+        # Номер следующей таблицы в SQLite
+        self.table_count = 0
+
+        self.tables = []
+        # [(dbms, db, stream, connection), ...] - соединения, взятые из пулов DBMS
+        self.connections = []
+        self.sqlite_conn = None
+        # Словарь закодированных строк (encoding.Dictionary) в sqlite_conn
+        self.dictionary = None
+        # Загрузка в SQLite из нескольких потоков выполняется по очереди
+        self.sqlite_lock = threading.Lock()
+        # Ограничение объема SQLite в памяти, байт (None - без ограничения).
+        # При превышении база переносится во временный файл (spill)
+        self.memory_limit = None
+        # Временный файл SQLite: после переноса или при staging_dir в настройках.
+        # Другие процессы могут читать из него представление result
+        self.staging_path = None
+
+        self.profile = Profile()
+        # Заголовок и базовые типы колонок представления result
+        self.result_columns = []
+        self.result_types = []
+
+        # Причина прерывания запроса (QueryCancelled)
+        self.cancelled = None
+        self._timer = None
+
+        self._lock = threading.RLock()
+        self._tokens = []
+
+    def begin(self, timeout=None):
+        """
+        Начало выполнения запроса.
+        По истечении timeout секунд запрос будет прерван
+        """
+        self.reset()
+        self.cancelled = None
+        if timeout:
+            self._timer = threading.Timer(
+                timeout,
+                self.cancel,
+                [QueryTimeout('Query timeout ({} s)'.format(timeout))]
+            )
+            self._timer.daemon = True
+            self._timer.start()
+
+    def finish(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def cancel(self, reason=None):
+        """
+        Прерывает выполнение запроса: выполняемые на источниках запросы
+        отменяются через cursor.cancel(), загрузка в SQLite прерывается.
+        Может вызываться из любого потока
+        """
+        self.cancelled = reason or QueryCancelled('Query cancelled')
+        with self._lock:
+            tables = list(self.tables)
+        for table in tables:
+            table.cancel()
+        if self.sqlite_conn:
+            self.sqlite_conn.interrupt()
+
+    def check(self):
+        """
+        Точка кооперативной отмены между этапами выполнения
+        """
+        if self.cancelled:
+            raise self.cancelled
+
+    def reset(self):
+        """
+        Сброс состояния перед выполнением очередного запроса
+        """
+        self.is_crashed = False
+        self.errors = []
+        self.buffer = []
+        self.parser = None
+        self.log_mode = 0
+        self.log_size = 0
+        self.is_sqlite = False
+        self.table_count = 0
+        self.tables = []
+        self.profile = Profile(self.cc.profile_bytes if self.cc else False)
+        self.memory_limit = self.cc.memory_limit if self.cc else None
+
+    def reconnect(self):
+        self._disconnect()
+        staging_dir = self.cc.staging_dir if self.cc else None
+        if staging_dir is not None:
+            self.sqlite_conn = self._connect_file(staging_dir)
+        else:
+            # uri=True, чтобы можно было присоединить кэш (cache.StagingCache.attach)
+            self.sqlite_conn = sqlite3.connect(':memory:', uri=True, check_same_thread=False)
+        self.dictionary = None
+        return self.sqlite_conn
+
+    def _connect_file(self, directory=None):
+        """
+        SQLite во временном файле staging_path, чтение через mmap.
+        Файл нужен только на время запроса, поэтому журнал не ведется
+        """
+        fd, path = tempfile.mkstemp(prefix='multidb_', suffix='.sqlite', dir=directory)
+        os.close(fd)
+        self.staging_path = path
+        conn = sqlite3.connect(path, uri=True, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA temp_store = FILE')
+        if self.cc is not None and self.cc.mmap_size:
+            conn.execute('PRAGMA mmap_size = {}'.format(int(self.cc.mmap_size)))
+        if self.memory_limit is not None:
+            conn.execute('PRAGMA cache_size = {}'.format(-max(1, self.memory_limit // 1024)))
+        return conn
+
+    def check_memory(self):
+        """
+        Переносит SQLite из памяти во временный файл, если объем базы
+        превысил memory_limit. Дальше загрузка и выполнение запроса идут
+        в файле, кэш страниц ограничен memory_limit, сортировки и временные
+        индексы соединений SQLite также пишет во временные файлы.
+        Вызывается под sqlite_lock вне транзакции
+        """
+        if self.memory_limit is None or self.staging_path is not None:
+            return
+        page_count, = self.sqlite_conn.execute('PRAGMA page_count').fetchone()
+        page_size, = self.sqlite_conn.execute('PRAGMA page_size').fetchone()
+        if page_count * page_size <= self.memory_limit:
+            return
+
+        conn = self._connect_file()
+        self.sqlite_conn.backup(conn)
+        self.logger.info('Staging database (%s pages) spilled to %s', page_count, self.staging_path)
+
+        memory_conn, self.sqlite_conn = self.sqlite_conn, conn
+        memory_conn.close()
+        if self.dictionary is not None:
+            self.dictionary.conn = conn
+
+    def next_table_number(self):
+        number = self.table_count
+        self.table_count += 1
+        return number
+
+    def connect(self, dbms, db, stream=False):
+        """
+        Соединение с базой данных источника.
+        Каждая таблица получает собственное соединение,
+        чтобы выгрузка таблиц могла идти параллельно
+        """
+        conn = dbms.acquire(db, stream)
+        with self._lock:
+            self.connections.append((dbms, db, stream, conn))
+        return conn
+
+    def release(self):
+        """
+        Возвращает соединения с источниками в пулы DBMS
+        """
+        with self._lock:
+            tables, self.tables = self.tables, []
+            connections, self.connections = self.connections, []
+        for table in tables:
+            table.close()
+        for dbms, db, stream, conn in connections:
+            dbms.release(db, conn, stream)
+
+    def close(self):
+        self.release()
+        self._disconnect()
+        self.sqlite_conn = None
+
+    def _disconnect(self):
+        if self.sqlite_conn:
+            self.sqlite_conn.close()
+        if self.staging_path is not None:
+            try:
+                os.remove(self.staging_path)
+            except OSError:
+                pass
+            self.staging_path = None
+
+    def __enter__(self):
+        self._tokens.append(_current.set(self))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current.reset(self._tokens.pop())
+
+
+# Контекст по умолчанию используется, когда парсер
+# вызывается напрямую, вне ControlCenter
+DEFAULT_CONTEXT = QueryContext()
+
+_current = contextvars.ContextVar('multidb_query_context', default=DEFAULT_CONTEXT)
+
+
+def current() -> QueryContext:
+    return _current.get()
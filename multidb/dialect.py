@@ -1,9 +1,16 @@
+import json
 import logging
-from collections import namedtuple
+import os
+import re
+import sqlite3
+import threading
+from collections import namedtuple, OrderedDict
 from itertools import groupby
 from operator import itemgetter
 
-from .parser import IndexParser, kw
+import pyodbc
+
+from . import keywords as kw
 
 
 class Index:
@@ -30,6 +37,9 @@ class Index:
 
 IndexColumn = namedtuple('IndexColumn', 'name order')
 
+# Оценка запроса источником: ожидаемое количество строк и стоимость
+Estimate = namedtuple('Estimate', 'rows cost')
+
 
 class BaseDialect:
     logger = logging.getLogger('base_dialect')
@@ -74,8 +84,18 @@ class BaseDialect:
         "and table_name = '{table}' "
         "order by ordinal_position;"
     )
+    # Оценка количества строк в таблице по статистике источника
+    SQL_GET_ROW_COUNT = None
+    # Запрос плана выполнения в формате JSON
+    SQL_EXPLAIN = None
+    ESTIMATE_CACHE_SIZE = 1024
+    # Параметры соединения для потоковой выгрузки больших таблиц:
+    # строки результата не буферизуются драйвером целиком
+    STREAM_OPTIONS = []
+    # Большую таблицу можно выгружать несколькими запросами параллельно
+    PARTITIONED = True
 
-    def conn_str(self, database):
+    def conn_str(self, database, stream=False):
         driver = self.driver or self.DBMS_TO_DRIVER[self.__class__.__name__]
         conn_str = ';'.join(
             '='.join([k, v])
@@ -86,11 +106,40 @@ class BaseDialect:
                 ('DATABASE', database),
                 ('UID', self.uid),
                 ('PWD', self.pwd),
-            ]
+            ] + (self.STREAM_OPTIONS if stream else [])
             if v
         )
         return conn_str
 
+    def connect(self, database, login_timeout=None, timeout=None, stream=False):
+        kwargs = {'timeout': login_timeout} if login_timeout else {}
+        conn = pyodbc.connect(self.conn_str(database, stream), **kwargs)
+        if timeout:
+            conn.timeout = timeout
+        return conn
+
+    def execute(self, cursor, table, select_query):
+        """
+        Выполнение запроса данных таблицы (structures.Table).
+        Возвращает курсор, из которого читается результат
+        """
+        cursor.execute(select_query)
+        return cursor
+
+    def close(self):
+        """
+        Закрывает собственные соединения диалекта (не из пула DBMS)
+        """
+
+    def cancel(self, connection, cursor):
+        """
+        Прерывает выполняемый на соединении запрос
+        """
+        try:
+            cursor.cancel()
+        except pyodbc.Error:
+            pass
+
     def __init__(self, server, port, uid, pwd, driver=None):
         self.server = server
         self.port = str(port)
@@ -98,6 +147,10 @@ class BaseDialect:
         self.pwd = pwd
         self.driver = driver
 
+        # (database, select_query) -> Estimate
+        self._estimates = OrderedDict()
+        self._estimates_lock = threading.Lock()
+
     def all_schemas(self, cursor):
         cursor.execute(self.SQL_GET_SCHEMAS)
         return [schema for schema, in cursor.fetchall()]
@@ -120,6 +173,46 @@ class BaseDialect:
     def get_indexes(self, cursor, schema, table):
         return []
 
+    def row_count(self, cursor, schema, table):
+        if self.SQL_GET_ROW_COUNT is None:
+            return None
+        cursor.execute(self.SQL_GET_ROW_COUNT.format(schema=schema, table=table))
+        row = cursor.fetchone()
+        return None if row is None or row[0] is None else int(row[0])
+
+    def estimate(self, cursor, database, select_query):
+        """
+        Оценка запроса к источнику при помощи EXPLAIN.
+        Результаты кэшируются, при ошибке возвращается None
+        """
+        if self.SQL_EXPLAIN is None:
+            return None
+        key = (database, select_query)
+        with self._estimates_lock:
+            if key in self._estimates:
+                self._estimates.move_to_end(key)
+                return self._estimates[key]
+
+        try:
+            cursor.execute(self.SQL_EXPLAIN.format(query=select_query))
+            plan = json.loads(''.join(row[0] for row in cursor.fetchall()))
+            estimate = self.parse_explain(plan)
+        except Exception as ex:
+            self.logger.warning('Explain %s failed:\n%s', select_query, ex)
+            estimate = None
+
+        with self._estimates_lock:
+            self._estimates[key] = estimate
+            if len(self._estimates) > self.ESTIMATE_CACHE_SIZE:
+                self._estimates.popitem(last=False)
+        return estimate
+
+    def parse_explain(self, plan):
+        """
+        Estimate по результату SQL_EXPLAIN, None - оценки нет
+        """
+        return None
+
 
 class PostgreSQL(BaseDialect):
     TYPES = {
@@ -134,6 +227,98 @@ class PostgreSQL(BaseDialect):
     SUPPORTED_INDEX_TYPE = {
         'btree': Index.BTREE
     }
+    SQL_EXPLAIN = 'EXPLAIN (FORMAT JSON) {query}'
+    # psqlODBC: результат читается курсором DECLARE/FETCH порциями по Fetch строк
+    STREAM_OPTIONS = [
+        ('UseDeclareFetch', '1'),
+        ('Fetch', '10000'),
+    ]
+    SQL_GET_ROW_COUNT = (
+        "select "
+        "c.reltuples::bigint "
+        "from pg_class c "
+        "join pg_namespace n on n.oid = c.relnamespace "
+        "where "
+        "n.nspname = '{schema}' "
+        "and c.relname = '{table}';"
+    )
+
+    def __init__(self, server, port, uid, pwd, driver=None, copy=True):
+        super().__init__(server, port, uid, pwd, driver)
+        # Выгрузка через COPY, если установлен psycopg или psycopg2
+        self.copy = copy
+        # Пул свободных нативных соединений для COPY: db -> [connection, ...]
+        self._copy_connections = {}
+        # Базы, в которых COPY недоступен (pg_copy.is_unsupported): дальше выгрузка только через ODBC
+        self._copy_unavailable = set()
+        self._lock = threading.Lock()
+
+    def execute(self, cursor, table, select_query):
+        from . import pg_copy
+
+        if not self.copy or not pg_copy.is_available() or table.db in self._copy_unavailable:
+            return super().execute(cursor, table, select_query)
+        if table.streaming and not pg_copy.is_streaming():
+            # psycopg2 (copy_expert) читает весь результат COPY в память,
+            # большие таблицы выгружаются порциями через ODBC
+            return super().execute(cursor, table, select_query)
+        try:
+            conn = self._copy_connect(table.db, table.dbms.login_timeout, table.dbms.timeout)
+            copy_cursor = pg_copy.CopyCursor(
+                conn,
+                select_query,
+                [column.dtype for column in table.selected_columns],
+                lambda c: self._copy_release(table.db, c),
+            )
+            # До начала COPY курсор должен быть доступен для отмены запроса
+            table.register_cursor(copy_cursor)
+            try:
+                return copy_cursor.start()
+            except Exception:
+                copy_cursor.close()
+                raise
+        except Exception as ex:
+            # Остальные ошибки - ошибки запроса: повторное выполнение через ODBC
+            # выполнило бы ошибочный или отмененный запрос второй раз
+            if not pg_copy.is_unsupported(ex):
+                raise
+            with self._lock:
+                self._copy_unavailable.add(table.db)
+            self.logger.warning('COPY %s failed, fallback to ODBC for database %s:\n%s', select_query, table.db, ex)
+            return super().execute(cursor, table, select_query)
+
+    def _copy_connect(self, db, login_timeout=None, timeout=None):
+        """
+        Свободное нативное соединение из пула или новое
+        """
+        from . import pg_copy
+
+        with self._lock:
+            idle = self._copy_connections.get(db)
+            while idle:
+                conn = idle.pop()
+                if not conn.closed:
+                    return conn
+        return pg_copy.connect(self.server, self.port, db, self.uid, self.pwd, login_timeout, timeout)
+
+    def _copy_release(self, db, conn):
+        with self._lock:
+            self._copy_connections.setdefault(db, []).append(conn)
+
+    def close(self):
+        with self._lock:
+            connections, self._copy_connections = self._copy_connections, {}
+        for idle in connections.values():
+            for conn in idle:
+                conn.close()
+
+    def __del__(self):
+        self.close()
+
+    def parse_explain(self, plan):
+        # [{"Plan": {"Node Type": ..., "Total Cost": ..., "Plan Rows": ...}}]
+        root = plan[0]['Plan']
+        return Estimate(int(root['Plan Rows']), float(root['Total Cost']))
 
     def get_indexes(self, cursor, schema, table):
         query = (
@@ -144,6 +329,9 @@ class PostgreSQL(BaseDialect):
             "where "
             "schemaname='{}' and tablename='{}';"
         ).format(schema, table)
+        # parser -> dml -> structures -> dialect
+        from .parser import IndexParser
+
         cursor.execute(query)
         indexes = []
         for name, define, in cursor.fetchall():
@@ -190,6 +378,28 @@ class MySQL(BaseDialect):
     SUPPORTED_INDEX_TYPE = {
         'btree': Index.BTREE
     }
+    SQL_EXPLAIN = 'EXPLAIN FORMAT=JSON {query}'
+    # MySQL ODBC: без кэширования результата на клиенте, курсор только вперед
+    STREAM_OPTIONS = [
+        ('NO_CACHE', '1'),
+        ('FORWARD_CURSOR', '1'),
+    ]
+    SQL_GET_ROW_COUNT = (
+        "select "
+        "table_rows "
+        "from information_schema.tables "
+        "where "
+        "table_schema = '{schema}' "
+        "and table_name = '{table}';"
+    )
+
+    def parse_explain(self, plan):
+        # {"query_block": {"cost_info": {"query_cost": ...}, "table": {"rows_produced_per_join": ...}}}
+        block = plan['query_block']
+        cost = float(block['cost_info']['query_cost'])
+        table = block.get('table', {})
+        rows = table.get('rows_produced_per_join', table.get('rows_examined_per_scan'))
+        return Estimate(None if rows is None else int(rows), cost)
 
     def get_indexes(self, cursor, schema, table):
         query = (
@@ -228,4 +438,192 @@ class MySQL(BaseDialect):
 
 
 class SQLite(BaseDialect):
-    pass
+    """
+    Файлы SQLite, открываемые напрямую через sqlite3 (без ODBC).
+    База данных db - файл <path>/<db>.<extension>, схема - main
+    или имя присоединенной базы данных
+    """
+    logger = logging.getLogger('sqlite_dialect')
+
+    # Тип колонки в SQLite произвольный, базовый тип определяется
+    # по правилам column affinity: первое найденное вхождение
+    AFFINITY = [
+        ('BOOL', BaseDialect.BOOL),
+        ('BIGINT', BaseDialect.LONG),
+        ('INT', BaseDialect.INT),
+        ('CHAR', BaseDialect.STRING),
+        ('CLOB', BaseDialect.STRING),
+        ('TEXT', BaseDialect.STRING),
+        ('REAL', BaseDialect.FLOAT),
+        ('FLOA', BaseDialect.FLOAT),
+        ('DOUB', BaseDialect.FLOAT),
+    ]
+    TYPE_LENGTH_REGEXP = re.compile(r'\(\s*(\d+)\s*\)')
+
+    SQL_GET_SCHEMAS = (
+        'select name '
+        'from pragma_database_list;'
+    )
+    SQL_GET_TABLES = (
+        "select "
+        "name "
+        "from \"{schema}\".sqlite_master "
+        "where "
+        "type in ('table', 'view') "
+        "and name not like 'sqlite_%';"
+    )
+    SQL_GET_COLUMNS = (
+        "select "
+        "  name "
+        ", not \"notnull\" "
+        ", type "
+        ", pk "
+        "from pragma_table_info('{table}', '{schema}') "
+        "order by cid;"
+    )
+    SQL_GET_INDEXES = (
+        "select "
+        "  l.name "          # 0
+        ", l.\"unique\" "    # 1
+        ", c.\"desc\" "      # 2
+        ", c.name "          # 3
+        "from pragma_index_list('{table}', '{schema}') as l "
+        "join pragma_index_xinfo(l.name, '{schema}') as c "
+        "where "
+        "not l.partial "
+        "and c.key "
+        "order by l.name, c.seqno;"
+    )
+    SQL_GET_TYPE = (
+        "select type "
+        "from \"{schema}\".sqlite_master "
+        "where name = '{table}';"
+    )
+    # Количество строк по статистике ANALYZE: первое число stat
+    SQL_GET_STAT = (
+        "select stat "
+        "from \"{schema}\".sqlite_stat1 "
+        "where tbl = '{table}' "
+        "limit 1;"
+    )
+    # Для таблиц с rowid - верхняя граница по последней записи b-дерева
+    SQL_GET_MAX_ROWID = 'select max(rowid) from "{schema}"."{table}";'
+    SQL_GET_ROW_COUNT = 'select count(*) from "{schema}"."{table}";'
+
+    def __init__(self, path, extension='sqlite', uri=False):
+        super().__init__(None, None, None, None)
+        self.path = path
+        self.extension = extension
+        # Если uri включен, то path - шаблон URI (file:...{db}...)
+        self.uri = uri
+
+    def database(self, database):
+        if self.uri:
+            return self.path.format(db=database)
+        return 'file:{}?mode=ro'.format(os.path.join(
+            self.path,
+            '{}.{}'.format(database, self.extension) if self.extension else database
+        ))
+
+    def conn_str(self, database, stream=False):
+        return self.database(database)
+
+    def connect(self, database, login_timeout=None, timeout=None, stream=False):
+        # Источник открывается только для чтения, поэтому
+        # отсутствующий файл не создается, а вызывает ошибку.
+        # timeout - время ожидания блокировки файла
+        return sqlite3.connect(
+            self.database(database),
+            timeout=timeout or login_timeout or 5.0,
+            uri=True,
+            check_same_thread=False
+        )
+
+    def cancel(self, connection, cursor):
+        try:
+            connection.interrupt()
+        except sqlite3.ProgrammingError:
+            pass
+
+    def base_type(self, dtype):
+        upper = dtype.upper()
+        for pattern, base_type in self.AFFINITY:
+            if pattern in upper:
+                return base_type
+        return None
+
+    def all_columns(self, cursor, schema, table):
+        cursor.execute(self.SQL_GET_COLUMNS.format(schema=schema, table=table))
+        columns = []
+        for name, is_null, dtype, pk in cursor.fetchall():
+            new_dtype = self.base_type(dtype)
+            max_len = None
+            if new_dtype == self.STRING:
+                match = self.TYPE_LENGTH_REGEXP.search(dtype)
+                max_len = match and int(match.group(1))
+            columns.append((
+                name,
+                bool(is_null) and not pk,
+                new_dtype or dtype,
+                max_len,
+                max_len and max_len * 4,
+                bool(new_dtype)
+            ))
+        return columns
+
+    def row_count(self, cursor, schema, table):
+        """
+        Оценка количества строк: статистика sqlite_stat1 (если выполнялся ANALYZE),
+        max(rowid) для таблиц с rowid, иначе (WITHOUT ROWID, пустые таблицы) count(*).
+        Для представлений оценки нет: любой подсчет выполняет представление целиком.
+        Прочие ошибки (в том числе interrupted при отмене запроса) не перехватываются
+        """
+        cursor.execute(self.SQL_GET_TYPE.format(schema=schema, table=table))
+        row = cursor.fetchone()
+        if row is not None and row[0] == 'view':
+            return None
+        try:
+            cursor.execute(self.SQL_GET_STAT.format(schema=schema, table=table))
+            row = cursor.fetchone()
+            if row is not None and row[0]:
+                return int(row[0].split()[0])
+        except sqlite3.OperationalError as ex:
+            if 'no such table' not in str(ex):
+                raise
+        try:
+            cursor.execute(self.SQL_GET_MAX_ROWID.format(schema=schema, table=table))
+            row = cursor.fetchone()
+            if row is not None and row[0] is not None:
+                return int(row[0])
+        except sqlite3.OperationalError as ex:
+            # Таблица WITHOUT ROWID
+            if 'no such column' not in str(ex):
+                raise
+        return super().row_count(cursor, schema, table)
+
+    def get_indexes(self, cursor, schema, table):
+        cursor.execute(self.SQL_GET_INDEXES.format(schema=schema, table=table))
+        indexes = [
+            Index(name, columns, bool(is_unique), Index.BTREE)
+            for (name, is_unique), data in groupby(
+                cursor.fetchall(),
+                key=itemgetter(0, 1)
+            )
+            for columns in [[
+                IndexColumn(col_name, not desc)
+                for _, _, desc, col_name in data
+            ]]
+            # Индексы по выражениям не поддерживаются
+            if all(column.name is not None for column in columns)
+        ]
+
+        # INTEGER PRIMARY KEY - псевдоним rowid, в pragma_index_list не попадает
+        cursor.execute(self.SQL_GET_COLUMNS.format(schema=schema, table=table))
+        primary_key = [
+            (name, dtype)
+            for name, _, dtype, pk in cursor.fetchall()
+            if pk
+        ]
+        if len(primary_key) == 1 and primary_key[0][1].upper() == 'INTEGER':
+            indexes.append(Index('rowid', [IndexColumn(primary_key[0][0], True)], True, Index.BTREE))
+        return indexes
@@ -1,12 +1,17 @@
 import logging
 
+from . import context
+from . import encoding
 from . import expression as expr
 from . import join as jn
 from . import structures as st
 from . import symbols as ss
 from . import utils
 from ._logger import ParserLogger
+from .dialect import BaseDialect
 from .exceptions import UnreachableException, SemanticException
+from .profiling import Profile
+import time
 from itertools import product, groupby
 from functools import reduce
 import pypika as pk
@@ -590,7 +595,7 @@ class Select:
 
             if self.join_expr_equals:
                 index = pk.Criterion.all([
-                    (a.pika() == b.pika())
+                    expr.ComparisonPredicate(a, b, ss.equals_operator).pika()
                     for a, b in self.join_expr_equals
                 ])
 
@@ -613,6 +618,9 @@ class Select:
 
         self.alias_table = {}
         self.alias_selection = {}
+        # Имена колонок результата: псевдоним или имя колонки таблицы
+        # (None - выражение без псевдонима), см. result_names
+        self.select_names = []
 
         self.name_to_table = {}
 
@@ -632,11 +640,43 @@ class Select:
             for _ in [self.full_table_list.append([])]
         ]
 
+    @property
+    def tables(self):
+        return [
+            table
+            for lvl in self.full_table_list
+            for table in lvl
+        ]
+
     @property
     def result_columns(self):
         return [s.short_name or 'column_{}'.format(i+1)
                 for i, s in enumerate(self.select_list)]
 
+    @property
+    def result_types(self):
+        return [getattr(s, 'dtype', None) for s in self.select_list]
+
+    @property
+    def result_names(self):
+        """
+        Имена колонок результата для сохранения в таблицу (материализованное
+        представление): псевдоним, имя колонки таблицы или column_<номер>.
+        Повторяющиеся имена дополняются номером: id, id_2
+        """
+        names = []
+        used = set()
+        for i, name in enumerate(self.select_names):
+            name = name or 'column_{}'.format(i+1)
+            unique, n = name, 1
+            # Имена колонок в SQLite не зависят от регистра
+            while unique.lower() in used:
+                n += 1
+                unique = '{}_{}'.format(name, n)
+            used.add(unique.lower())
+            names.append(unique)
+        return names
+
     def check_all_tables(self, table):
         """
         Грязная функция - меняет состояния уже существующих объектов
@@ -661,7 +701,8 @@ class Select:
                     table.specification = self.validate_expression(table.specification.convolution.to_bool)
                     # TODO: Подумать
                     if True or isinstance(table.specification, expr.BooleanExpression):
-                        table.specification = self.PDNF(table.specification)
+                        with context.current().profile.stage(Profile.PDNF):
+                            table.specification = self.PDNF(table.specification)
 
             return None, None
 
@@ -788,6 +829,7 @@ class Select:
         все такие колонки помечаются как используемые
         """
         select_list = []
+        select_names = []
 
         if isinstance(self.select_list, str):  # all columns for all tables
             assert self.select_list == ss.asterisk
@@ -797,6 +839,7 @@ class Select:
                         column.used = True
                         column.visible = True
                     select_list.extend(tbl.columns)
+                    select_names.extend(column.name for column in tbl.columns)
         else:
             for is_qualified_asterisk, selection in self.select_list:
                 if is_qualified_asterisk:  # all column for one table
@@ -808,6 +851,7 @@ class Select:
                         column.used = True
                         column.visible = True
                     select_list.extend(tbl.columns)
+                    select_names.extend(column.name for column in tbl.columns)
                 else:  # expression
                     short_name = selection.short_name
                     repr_name = repr(selection)
@@ -816,7 +860,9 @@ class Select:
                         self.alias_selection[short_name] = e
                     e.as_(short_name or repr_name)
                     select_list.append(e)
+                    select_names.append(short_name or (e.name if isinstance(e, st.Column) else None))
         self.select_list = select_list
+        self.select_names = select_names
 
     def validate_expression(self, expression, visible=False):
         """
@@ -883,8 +929,9 @@ class Select:
         self.where = self.where and self.validate_expression(self.where.convolution.to_bool)
         # TODO: Подумать
         if True or isinstance(self.where, expr.BooleanExpression):
-            self.where = self.PDNF(self.where)
-            self.where.basis_classifier_for_where()
+            with context.current().profile.stage(Profile.PDNF):
+                self.where = self.PDNF(self.where)
+                self.where.basis_classifier_for_where()
 
     @staticmethod
     def get_used_columns(expression, count_used=False):
@@ -915,11 +962,20 @@ class Select:
             return left + right
         return []
 
+    @staticmethod
+    def _select_sql(term):
+        sql = term.get_sql(with_namespace=True)
+        if isinstance(term, encoding.Decode):
+            # Имя колонки результата как у незакодированной колонки
+            sql = '{} AS "{}"'.format(sql, term.name)
+        return sql
+
     def get_sql(self):
-        st.Table.IS_SQLITE = True
+        ctx = context.current()
+        ctx.is_sqlite = True
         from_sql = ', '.join([f.get_sql() for f in self.from_])
         select_sql = ', '.join([
-            s.pika().as_(alias).get_sql(with_namespace=True)
+            self._select_sql(s.pika().as_(alias))
             for i, s in enumerate(self.select_list)
             for alias in [s.short_name or 'column_{}'.format(i+1)]
         ])
@@ -928,5 +984,215 @@ class Select:
             where_pika = self.where.pika()
             if where_pika:
                 sql = '{} WHERE {}'.format(sql, where_pika.get_sql(with_namespace=True))
-        st.Table.IS_SQLITE = False
+        ctx.is_sqlite = False
         return sql
+
+
+class Explain:
+    """
+    EXPLAIN [ANALYZE] <select>
+
+    План содержит дерево соединений, запросы к источникам с вынесенными
+    в них фильтрами, оставшиеся условия (PDNF.pika()), ключи соединений
+    и оценку количества строк для каждого источника.
+    Для EXPLAIN ANALYZE запрос выполняется, и в план добавляются
+    фактическое время и количество строк для каждого узла
+    """
+    HEADER = ['QUERY PLAN']
+    INDENT = '  '
+
+    def __init__(self, select: Select, analyze=False):
+        self.select = select
+        self.analyze = analyze
+
+    def validate(self):
+        self.select.validate()
+
+    def get_sql(self):
+        return self.select.get_sql()
+
+    @property
+    def tables(self):
+        return self.select.tables
+
+    @property
+    def result_columns(self):
+        return self.HEADER
+
+    @property
+    def result_types(self):
+        return [BaseDialect.STRING] * len(self.HEADER)
+
+    def nodes(self):
+        """
+        Обход дерева соединений, возвращает пары (узел, глубина)
+        """
+        def walk(node, depth):
+            yield node, depth
+            if isinstance(node, jn.BaseJoin):
+                yield from walk(node.left, depth + 1)
+                yield from walk(node.right, depth + 1)
+
+        for root in self.select.from_:
+            yield from walk(root, 0)
+
+    def analyze_nodes(self, sqlite_conn):
+        """
+        Фактическое количество строк и время выполнения
+        для каждого соединения и для всего результата
+        """
+        ctx = context.current()
+        joins = [node for node, _ in self.nodes() if isinstance(node, jn.BaseJoin)]
+        ctx.is_sqlite = True
+        try:
+            queries = [(id(node), node.get_sql()) for node in joins]
+        finally:
+            ctx.is_sqlite = False
+        queries.append((id(self), 'result'))
+
+        actual = {}
+        for key, sql in queries:
+            start = time.perf_counter()
+            count, = sqlite_conn.execute('SELECT count(*) FROM {}'.format(sql)).fetchone()
+            actual[key] = count, time.perf_counter() - start
+        return actual
+
+    @staticmethod
+    def _actual(rows, duration):
+        return '(actual rows={}, time={:.3f} ms)'.format(rows, duration * 1000)
+
+    def plan(self, actual=None, profile=None):
+        """
+        Текстовое представление плана, по строке на элемент списка
+        """
+        ctx = context.current()
+        summary = profile.summary() if profile else {}
+        remote = {
+            id(table): table.select_query.get_sql()
+            for table in self.tables
+        }
+        filters = {
+            id(table): [str(f.pika()) for f in table.filters]
+            for table in self.tables
+        }
+        estimates = {
+            id(table): (table.estimated_rows, table.estimate and table.estimate.cost)
+            for table in self.tables
+        }
+
+        lines = []
+        ctx.is_sqlite = True
+        try:
+            head = 'Result'
+            if actual:
+                head = '{}  {}'.format(head, self._actual(*actual[id(self)]))
+            lines.append(head)
+            if self.select.where:
+                where = self.select.where.pika()
+                if where:
+                    lines.append('{}Filter: {}'.format(self.INDENT, where.get_sql(with_namespace=True)))
+
+            for node, depth in self.nodes():
+                indent = self.INDENT * (depth + 1)
+                detail = indent + self.INDENT * 2
+                if isinstance(node, jn.BaseJoin):
+                    kind = 'CROSS' if isinstance(node, jn.CrossJoin) else node.type
+                    line = '{}-> {} JOIN'.format(indent, kind)
+                    if actual:
+                        line = '{}  {}'.format(line, self._actual(*actual[id(node)]))
+                    lines.append(line)
+                    if isinstance(node, jn.RightJoin):
+                        lines.append('{}Executed as LEFT JOIN with swapped operands'.format(detail))
+                    if isinstance(node, jn.QualifiedJoin):
+                        spec = node.specification
+                        keys = getattr(spec, 'join_expr_equals', [])
+                        if keys:
+                            # Ключи и условие соединения форматируются одинаково (с кавычками)
+                            lines.append('{}Join keys: {}'.format(detail, ', '.join(
+                                (a.pika() == b.pika()).get_sql(with_namespace=True)
+                                for a, b in keys
+                            )))
+                        condition = spec.pika()
+                        if condition:
+                            lines.append('{}Join condition: {}'.format(
+                                detail,
+                                condition.get_sql(with_namespace=True)
+                            ))
+                elif isinstance(node, st.Table):
+                    rows, cost = estimates[id(node)]
+                    line = '{}-> Scan {} as {}  (estimated rows={}{})'.format(
+                        indent,
+                        node.source_name,
+                        node.sqlite_table.get_sql(),
+                        rows,
+                        '' if cost is None else ', cost={:.2f}'.format(cost)
+                    )
+                    if actual:
+                        fetch = summary.get(Profile.FETCH, {}).get('sources', {}).get(node.source_name, {})
+                        line = '{}  {}'.format(line, self._actual(fetch.get('rows'), sum(
+                            summary.get(name, {}).get('sources', {}).get(node.source_name, {}).get('duration', 0.0)
+                            for name in (Profile.EXECUTE, Profile.FETCH, Profile.INSERT)
+                        )))
+                    lines.append(line)
+                    lines.append('{}Remote query: {}'.format(detail, remote[id(node)]))
+                    if filters[id(node)]:
+                        lines.append('{}Pushed filters: {}'.format(detail, ' AND '.join(filters[id(node)])))
+                    if actual:
+                        lines.append('{}Stages: {}'.format(detail, ', '.join(
+                            '{}={:.3f} ms'.format(name, data['duration'] * 1000)
+                            for name in (Profile.EXECUTE, Profile.FETCH, Profile.INSERT)
+                            for data in [summary.get(name, {}).get('sources', {}).get(node.source_name)]
+                            if data
+                        )))
+        finally:
+            ctx.is_sqlite = False
+        return lines
+
+
+class MaterializedView:
+    """
+    CREATE MATERIALIZED VIEW <name> [REFRESH EVERY <seconds>] AS <select>
+    REFRESH MATERIALIZED VIEW <name>
+    DROP MATERIALIZED VIEW <name>
+
+    Результат запроса сохраняется в кэше (cache.StagingCache), в следующих
+    запросах к нему можно обращаться по имени name. При обновлении сохраненный
+    запрос выполняется заново, таблицы с водяными знаками выгружаются инкрементально.
+    Для REFRESH и DROP запрос (select) не задается
+    """
+    CREATE = 'CREATE'
+    REFRESH = 'REFRESH'
+    DROP = 'DROP'
+    HEADER = ['status']
+
+    def __init__(self, action, name, select: Select = None, query=None, refresh_every=None):
+        self.action = action
+        self.name = name
+        self.select = select
+        # Исходный текст select для повторного выполнения
+        self.query = query
+        # Период автоматического обновления, в секундах
+        self.refresh_every = refresh_every
+
+    def validate(self):
+        if self.select is not None:
+            self.select.validate()
+
+    def get_sql(self):
+        return self.select.get_sql() if self.select is not None else None
+
+    @property
+    def tables(self):
+        return self.select.tables if self.select is not None else []
+
+    @property
+    def result_columns(self):
+        return self.select.result_columns if self.select is not None else self.HEADER
+
+    @property
+    def result_types(self):
+        return self.select.result_types if self.select is not None else [BaseDialect.STRING] * len(self.HEADER)
+
+    @property
+    def result_names(self):
+        return self.select.result_names if self.select is not None else self.HEADER
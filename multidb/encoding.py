@@ -0,0 +1,152 @@
+"""
+Словарное кодирование строковых колонок при загрузке в SQLite.
+
+Если в первой порции строк таблицы доля различных значений строковой
+колонки не больше dictionary_ratio (настройка multidb), то в SQLite
+хранятся целые коды, а сами строки - в общей для запроса таблице
+multidb_dict. Равные строки всех таблиц запроса получают равные коды,
+поэтому равенство двух закодированных колонок (ключи соединения)
+и закодированной колонки со строкой проверяется по кодам,
+в остальных выражениях и в результате значение декодируется
+подзапросом к multidb_dict
+"""
+import threading
+
+from pypika.terms import Term, ValueWrapper
+
+from .dialect import BaseDialect
+
+DICTIONARY_TABLE = 'multidb_dict'
+DEFAULT_RATIO = 0.1
+# Меньшие таблицы не кодируются
+MIN_ROWS = 1000
+# Количество строк порции, по которым оценивается число различных значений
+SAMPLE_SIZE = 10000
+
+SQL_CREATE_DICTIONARY = 'CREATE TABLE {} (code integer PRIMARY KEY, value varchar)'.format(DICTIONARY_TABLE)
+SQL_INSERT_DICTIONARY = 'INSERT INTO {} VALUES (?, ?)'.format(DICTIONARY_TABLE)
+
+
+def decode_sql(code_sql):
+    return '(SELECT value FROM {} WHERE code = {})'.format(DICTIONARY_TABLE, code_sql)
+
+
+def code_sql(value_sql):
+    # Коды начинаются с 1, отсутствующей в словаре строке соответствует 0
+    return 'coalesce((SELECT code FROM {} WHERE value = {}), 0)'.format(DICTIONARY_TABLE, value_sql)
+
+
+class Encode(Term):
+    """
+    Код строки для сравнения с закодированной колонкой
+    """
+
+    def __init__(self, value):
+        super().__init__()
+        self.value = ValueWrapper(value)
+
+    def nodes_(self):
+        yield self
+        yield from self.value.nodes_()
+
+    def get_sql(self, **kwargs):
+        kwargs.pop('with_alias', None)
+        return code_sql(self.value.get_sql(**kwargs))
+
+
+class Decode(Term):
+    """
+    Значение закодированной колонки: подзапрос к словарю по коду
+    """
+
+    def __init__(self, field, name):
+        super().__init__()
+        self.field = field
+        # Имя колонки результата, если значение выбирается в SELECT
+        self.name = name
+
+    def nodes_(self):
+        yield self
+        yield from self.field.nodes_()
+
+    def get_sql(self, **kwargs):
+        kwargs.pop('with_alias', None)
+        return decode_sql(self.field.get_sql(**kwargs))
+
+
+class Dictionary:
+    """
+    Словарь запроса: строка -> код, хранится вместе с multidb_dict
+    в SQLite контекста и создается заново при ctx.reconnect()
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.codes = {}
+        self._lock = threading.Lock()
+        conn.execute(SQL_CREATE_DICTIONARY)
+
+    def encode(self, rows, idx):
+        """
+        Строки с кодами вместо значений колонок idx,
+        новые значения добавляются в multidb_dict
+        """
+        codes = self.codes
+        with self._lock:
+            new = {}
+            for row in rows:
+                for i in idx:
+                    value = row[i]
+                    if value is not None and value not in codes and value not in new:
+                        new[value] = len(codes) + len(new) + 1
+            if new:
+                self.conn.executemany(SQL_INSERT_DICTIONARY, [(code, value) for value, code in new.items()])
+                codes.update(new)
+        result = []
+        for row in rows:
+            row = list(row)
+            for i in idx:
+                value = row[i]
+                if value is not None:
+                    row[i] = codes[value]
+            result.append(row)
+        return result
+
+
+def choose_columns(table, rows, ratio):
+    """
+    Индексы строковых колонок table.selected_columns
+    с небольшим количеством различных значений в rows
+    """
+    sample = rows[:SAMPLE_SIZE]
+    if ratio is None or len(sample) < MIN_ROWS:
+        return []
+    limit = len(sample) * ratio
+    return [
+        i
+        for i, column in enumerate(table.selected_columns)
+        if column.dtype == BaseDialect.STRING
+        and len({row[i] for row in sample}) <= limit
+    ]
+
+
+def encode(ctx, table, rows):
+    """
+    Кодирование порции строк таблицы перед вставкой в SQLite.
+    По первой порции выбираются колонки для кодирования, и пустая таблица
+    в SQLite создается заново с целым типом этих колонок.
+    Вызывается под ctx.sqlite_lock
+    """
+    if table.encoded_idx is None:
+        ratio = ctx.cc.dictionary_ratio if ctx.cc is not None else None
+        table.encoded_idx = choose_columns(table, rows, ratio)
+        if table.encoded_idx:
+            for i in table.encoded_idx:
+                table.selected_columns[i].encoded = True
+            if ctx.dictionary is None:
+                ctx.dictionary = Dictionary(ctx.sqlite_conn)
+            ctx.sqlite_conn.execute('DROP TABLE {}'.format(table.sqlite_table.get_sql()))
+            ctx.sqlite_conn.execute(table.staging_create_query())
+    if not table.encoded_idx:
+        return rows
+    return ctx.dictionary.encode(rows, table.encoded_idx)
@@ -41,3 +41,17 @@ class NotSupported(Exception):
 
 class UnreachableException(Exception):
     pass
+
+
+class QueryCancelled(Exception):
+    """
+    Запрос прерван пользователем
+    """
+    pass
+
+
+class QueryTimeout(QueryCancelled):
+    """
+    Превышено время выполнения запроса
+    """
+    pass
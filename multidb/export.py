@@ -0,0 +1,229 @@
+"""
+Выгрузка результата запроса (представление result) в файлы CSV, Parquet и Arrow IPC.
+
+Строки читаются из ResultCursor порциями и сразу записываются в файл,
+поэтому в памяти находится не более одной порции. Типы колонок берутся
+из колонок запроса (Column.dtype), тип вычисляемых колонок определяется
+по первой порции
+"""
+import csv
+import gzip
+import io
+import json
+import os
+
+from .dialect import BaseDialect
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = ipc = pq = None
+
+CSV = 'csv'
+PARQUET = 'parquet'
+ARROW = 'arrow'
+JSONL = 'jsonl'
+
+EXTENSIONS = {
+    '.csv': CSV,
+    '.parquet': PARQUET,
+    '.arrow': ARROW,
+    '.feather': ARROW,
+}
+
+
+def kind_by_path(path):
+    """
+    Формат файла по расширению (сжатый CSV - .csv.gz)
+    """
+    root, ext = os.path.splitext(path.lower())
+    if ext == '.gz':
+        root, ext = os.path.splitext(root)
+    if ext not in EXTENSIONS:
+        raise ValueError('Unknown export format: {}'.format(path))
+    return EXTENSIONS[ext]
+
+
+class CSVWriter:
+    def __init__(self, path, header, types, compression=None):
+        if compression not in (None, 'gzip'):
+            raise ValueError('Unsupported CSV compression: {}'.format(compression))
+        if compression == 'gzip' or path.lower().endswith('.gz'):
+            self._file = gzip.open(path, 'wt', encoding='utf-8', newline='')
+        else:
+            self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(header)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class CSVStreamWriter:
+    """
+    CSV в двоичный файловый объект (ответ сервера, stdout)
+    """
+
+    def __init__(self, file, header, types, compression=None):
+        self.file = file
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self.write([header])
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self.file.write(self._buffer.getvalue().encode('utf-8'))
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def close(self):
+        pass
+
+
+class JSONLinesWriter:
+    """
+    JSON lines в двоичный файловый объект: первая строка
+    {"columns": [...], "types": [...]}, далее строки результата массивами
+    """
+
+    def __init__(self, file, header, types, compression=None):
+        self.file = file
+        self._write_lines([{'columns': header, 'types': types}])
+
+    def _write_lines(self, values):
+        self.file.write(''.join(
+            json.dumps(value, ensure_ascii=False, default=str) + '\n'
+            for value in values
+        ).encode('utf-8'))
+
+    def write(self, rows):
+        self._write_lines(rows)
+
+    def close(self):
+        pass
+
+
+class ArrowWriter:
+    """
+    Запись порций в Arrow IPC (file format).
+    Файл открывается при записи первой порции: по ней определяются
+    типы колонок, для которых тип запроса неизвестен
+    """
+    TYPES = {
+        BaseDialect.BOOL: 'bool_',
+        BaseDialect.INT: 'int64',
+        BaseDialect.LONG: 'int64',
+        BaseDialect.FLOAT: 'float64',
+        BaseDialect.STRING: 'string',
+    }
+
+    def __init__(self, path, header, types, compression=None):
+        if pa is None:
+            raise ImportError('pyarrow is required for {} export'.format(self.__class__.__name__))
+        self.path = path
+        self.header = header
+        self.types = types or [None] * len(header)
+        self.compression = compression
+        self.schema = None
+        self._writer = None
+
+    def _schema(self, columns):
+        fields = []
+        for name, dtype, values in zip(self.header, self.types, columns):
+            if dtype in self.TYPES:
+                kind = getattr(pa, self.TYPES[dtype])()
+            else:
+                kind = pa.array(values).type if values else pa.null()
+                if kind == pa.null():
+                    kind = pa.string()
+            fields.append(pa.field(name, kind))
+        return pa.schema(fields)
+
+    def _open(self):
+        options = ipc.IpcWriteOptions(compression=self.compression)
+        return ipc.new_file(self.path, self.schema, options=options)
+
+    def write(self, rows):
+        columns = list(zip(*rows)) or [()] * len(self.header)
+        if self._writer is None:
+            self.schema = self._schema(columns)
+            self._writer = self._open()
+        arrays = [
+            pa.array(
+                # В SQLite логические значения хранятся как 0 и 1
+                [None if v is None else bool(v) for v in values] if field.type == pa.bool_() else values,
+                type=field.type
+            )
+            for field, values in zip(self.schema, columns)
+        ]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self._writer is None:
+            # Пустой результат: файл только со схемой
+            self.write([])
+        self._writer.close()
+
+
+class ArrowStreamWriter(ArrowWriter):
+    """
+    Запись в Arrow IPC (stream format), path может быть файловым объектом,
+    например ответом сервера (server)
+    """
+
+    def _open(self):
+        options = ipc.IpcWriteOptions(compression=self.compression)
+        return ipc.new_stream(self.path, self.schema, options=options)
+
+
+class ParquetWriter(ArrowWriter):
+    """
+    Каждая порция записывается отдельной группой строк Parquet
+    """
+
+    def _open(self):
+        return pq.ParquetWriter(self.path, self.schema, compression=self.compression or 'none')
+
+    def write(self, rows):
+        if rows or self._writer is None:
+            super().write(rows)
+
+
+WRITERS = {
+    CSV: CSVWriter,
+    PARQUET: ParquetWriter,
+    ARROW: ArrowWriter,
+}
+
+# Форматы для записи в поток (server, командная строка)
+STREAM_WRITERS = {
+    JSONL: JSONLinesWriter,
+    CSV: CSVStreamWriter,
+    ARROW: ArrowStreamWriter,
+}
+
+
+def export(result, path, kind=None, compression=None):
+    """
+    Записывает строки result (ResultCursor) в файл path формата kind
+    (по умолчанию - по расширению файла), compression - кодек сжатия
+    (gzip для CSV, snappy/zstd/... для Parquet, lz4/zstd для Arrow).
+    Возвращает количество записанных строк
+    """
+    kind = kind or kind_by_path(path)
+    if kind not in WRITERS:
+        raise ValueError('Unknown export format: {}'.format(kind))
+    writer = WRITERS[kind](path, result.header, result.types, compression)
+    rows = 0
+    try:
+        for batch in result.batches():
+            writer.write(batch)
+            rows += len(batch)
+    finally:
+        writer.close()
+    return rows
@@ -4,6 +4,7 @@ from typing import Union, List
 
 import pypika as pk
 
+from . import encoding
 from . import mixins as mx
 from . import symbols as ss
 from . import utils
@@ -12,6 +13,8 @@ from functools import reduce
 
 
 class BaseExpression(mx.AsMixin):
+    __slots__ = ('is_base',)
+
     @property
     def convolution(self):
         """
@@ -48,6 +51,8 @@ class BaseExpression(mx.AsMixin):
 
 
 class PrimaryValue(BaseExpression):
+    __slots__ = ('value',)
+
     INT = 0
     FLOAT = 1
     STR = 2
@@ -94,35 +99,49 @@ class PrimaryValue(BaseExpression):
 
 
 class PrimaryNumeric(PrimaryValue):
+    __slots__ = ()
+
     @property
     def to_bool(self):
         return Bool(bool(self.value))
 
 
 class Int(PrimaryNumeric):
+    __slots__ = ()
+
     KIND = PrimaryValue.INT
 
 
 class Float(PrimaryNumeric):
+    __slots__ = ()
+
     KIND = PrimaryValue.FLOAT
 
 
 class Str(PrimaryValue):
+    __slots__ = ()
+
     # Todo: Does not work
     KIND = PrimaryValue.STR
 
 
 class Date(PrimaryValue):
+    __slots__ = ()
+
     # Todo: Does not work
     KIND = PrimaryValue.DATE
 
 
 class Datetime(PrimaryValue):
+    __slots__ = ()
+
     # Todo: Does not work
     KIND = PrimaryValue.DATETIME
 
 
 class Bool(PrimaryValue):
+    __slots__ = ()
+
     KIND = PrimaryValue.BOOL
 
     @property
@@ -131,6 +150,8 @@ class Bool(PrimaryValue):
 
 
 class Null(PrimaryValue):
+    __slots__ = ()
+
     KIND = PrimaryValue.NULL
 
     def __init__(self, value=None):
@@ -142,6 +163,8 @@ class Column(PrimaryValue):
     Используется как заглушка на момент парсинга
     Потом заменяется на объект Column из structures
     """
+    __slots__ = ()
+
     KIND = PrimaryValue.COLUMN
 
     def pika(self):
@@ -149,6 +172,8 @@ class Column(PrimaryValue):
 
 
 class SimpleExpression(BaseExpression):
+    __slots__ = ('expr',)
+
     logger = logging.getLogger('simple_expression')
 
     def __init__(self, expr):
@@ -160,6 +185,8 @@ class SimpleExpression(BaseExpression):
 
 
 class NumericExpression(BaseExpression):
+    __slots__ = ()
+
     logger = logging.getLogger('numeric_expression')
 
     def pika(self):
@@ -167,6 +194,8 @@ class NumericExpression(BaseExpression):
 
 
 class UnarySign(NumericExpression):
+    __slots__ = ('value', 'is_minus', 'sign')
+
     def __init__(self, value: BaseExpression, sign):
         assert sign in (ss.minus_sign, ss.plus_sign)
         super().__init__()
@@ -199,6 +228,8 @@ class UnarySign(NumericExpression):
 
 
 class DoubleNumericExpression(NumericExpression):
+    __slots__ = ('left', 'right')
+
     ADD = '+'
     SUB = '-'
     MUL = '*'
@@ -248,6 +279,8 @@ class DoubleNumericExpression(NumericExpression):
 
 
 class Add(DoubleNumericExpression):
+    __slots__ = ()
+
     op = DoubleNumericExpression.ADD
 
     def action(self, a, b):
@@ -265,6 +298,8 @@ class Add(DoubleNumericExpression):
 
 
 class Sub(DoubleNumericExpression):
+    __slots__ = ()
+
     op = DoubleNumericExpression.SUB
 
     def action(self, a, b):
@@ -282,6 +317,8 @@ class Sub(DoubleNumericExpression):
 
 
 class Mul(DoubleNumericExpression):
+    __slots__ = ()
+
     op = DoubleNumericExpression.MUL
 
     def action(self, a, b):
@@ -300,6 +337,8 @@ class Mul(DoubleNumericExpression):
 
 
 class Div(DoubleNumericExpression):
+    __slots__ = ()
+
     op = DoubleNumericExpression.DIV
 
     def action(self, a, b):
@@ -340,6 +379,8 @@ class Div(DoubleNumericExpression):
 
 
 class BooleanExpression(BaseExpression):
+    __slots__ = ()
+
     logger = logging.getLogger('boolean_expression')
 
     def calculate(self, vector):
@@ -366,6 +407,7 @@ class BooleanExpression(BaseExpression):
 
 
 class Not(BooleanExpression):
+    __slots__ = ('value',)
 
     def __init__(self, value: BaseExpression):
         super().__init__()
@@ -402,6 +444,8 @@ class Not(BooleanExpression):
 
 
 class DoubleBooleanExpression(BooleanExpression):
+    __slots__ = ('args',)
+
     AND = 'and'
     OR = 'or'
     IS = 'is'
@@ -476,6 +520,8 @@ class DoubleBooleanExpression(BooleanExpression):
 
 
 class Or(DoubleBooleanExpression):
+    __slots__ = ()
+
     op = DoubleBooleanExpression.OR
 
     def special_rules(self, bool_, none):
@@ -522,6 +568,8 @@ class Or(DoubleBooleanExpression):
 
 
 class And(DoubleBooleanExpression):
+    __slots__ = ()
+
     op = DoubleBooleanExpression.AND
 
     def special_rules(self, bool_, none):
@@ -568,6 +616,8 @@ class And(DoubleBooleanExpression):
 
 
 class Is(BooleanExpression):
+    __slots__ = ('left', 'right')
+
     op = DoubleBooleanExpression.IS
 
     def __init__(self, left: BaseExpression, right: Union[bool, None]):
@@ -609,11 +659,22 @@ class Is(BooleanExpression):
 
 
 class BasePredicate(BaseExpression):
+    __slots__ = ()
+
     def pika(self):
         raise NotImplementedError()
 
 
+def _is_encoded(operand):
+    """
+    Колонка, закодированная словарем, в выражении для SQLite запроса
+    """
+    return getattr(operand, 'encoded', False) and operand.table.context.is_sqlite
+
+
 class ComparisonPredicate(BasePredicate):
+    __slots__ = ('left', 'right', 'op', 'action')
+
     __MAP_NOT = [
         (ss.equals_operator, ss.not_equals_operator),
         (ss.less_than_operator, ss.greater_than_or_equals_operator),
@@ -677,10 +738,33 @@ class ComparisonPredicate(BasePredicate):
         self.action = self.MAP_ACTION[self.op]
 
     def pika(self):
+        if self.op in (ss.equals_operator, ss.not_equals_operator):
+            codes = self._code_pika(self.left, self.right)
+            if codes is not None:
+                return self.action(*codes)
         left = self.left.pika()
         right = self.right.pika()
         return self.action(left, right)
 
+    @staticmethod
+    def _code_pika(left, right):
+        """
+        Операнды сравнения на равенство по кодам словаря (encoding),
+        None, если закодированных колонок нет.
+        Словарь общий для запроса, поэтому равные строки имеют равные коды.
+        Коды есть только в SQLite запроса: для источника (запрос к таблице,
+        сигнатура выгрузки в кэше) условие остается исходным
+        """
+        left_encoded = _is_encoded(left)
+        right_encoded = _is_encoded(right)
+        if left_encoded and right_encoded:
+            return left.code_pika(), right.code_pika()
+        elif left_encoded and isinstance(right, Str):
+            return left.code_pika(), encoding.Encode(right.value)
+        elif right_encoded and isinstance(left, Str):
+            return encoding.Encode(left.value), right.code_pika()
+        return None
+
     def __eq__(self, other):
         # Fixme
         return False
@@ -690,12 +774,16 @@ class ComparisonPredicate(BasePredicate):
 
 
 class StringExpression(BaseExpression):
+    __slots__ = ()
+
     # Todo: Does not work
     def pika(self):
         raise NotImplementedError()
 
 
 class DatetimeExpression(BaseExpression):
+    __slots__ = ()
+
     # Todo: Does not work
     def pika(self):
         raise NotImplementedError()
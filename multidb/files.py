@@ -0,0 +1,473 @@
+"""
+Источник из файлов CSV и Parquet.
+
+Таблица dbms.db.schema.table - файл <path>/<db>/<schema>/<table>.csv
+(или .parquet). Из файла читаются только колонки, используемые в запросе,
+файл читается порциями. Условия WHERE, вынесенные в запрос к таблице
+(PDNF.basis_classifier_for_where), применяются к каждой порции при помощи
+SQLite, поэтому их семантика совпадает с семантикой остальных источников.
+Для Parquet группы строк, которые по статистике min/max не могут
+удовлетворить условиям вида <колонка> <оператор> <константа>, пропускаются
+"""
+import csv
+import logging
+import os
+import re
+import sqlite3
+from itertools import islice
+
+from . import dialect
+from . import expression as expr
+from . import symbols as ss
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pq = None
+
+CSV = 'csv'
+PARQUET = 'parquet'
+
+# Условие на колонку, используемое для пропуска групп строк Parquet
+OP_PRUNE = {
+    # op: (min, max, value) -> True, если в группе нет подходящих строк
+    ss.equals_operator: lambda lo, hi, v: v < lo or v > hi,
+    ss.less_than_operator: lambda lo, hi, v: lo >= v,
+    ss.less_than_or_equals_operator: lambda lo, hi, v: lo > v,
+    ss.greater_than_operator: lambda lo, hi, v: hi <= v,
+    ss.greater_than_or_equals_operator: lambda lo, hi, v: hi < v,
+}
+
+
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class FileTable:
+    """
+    Файл с данными таблицы
+    """
+    logger = logging.getLogger('file_table')
+
+    def __init__(self, path, kind, sample_size=1000, delimiter=',', encoding='utf-8'):
+        self.path = path
+        self.kind = kind
+        self.sample_size = sample_size
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self._columns = None
+        self._parquet = None
+        self._row_count = None
+
+    @property
+    def parquet(self):
+        if self._parquet is None:
+            if pq is None:
+                raise ImportError('pyarrow is required for parquet sources')
+            self._parquet = pq.ParquetFile(self.path)
+        return self._parquet
+
+    @property
+    def columns(self):
+        """
+        [(name, base_type), ...]
+        """
+        if self._columns is None:
+            self._columns = self._parquet_columns() if self.kind == PARQUET else self._csv_columns()
+        return self._columns
+
+    @property
+    def names(self):
+        return [name for name, _ in self.columns]
+
+    def _csv_reader(self, f):
+        return csv.reader(f, delimiter=self.delimiter)
+
+    def _csv_columns(self):
+        """
+        Типы колонок CSV определяются по первым sample_size строкам
+        """
+        with open(self.path, encoding=self.encoding, newline='') as f:
+            reader = self._csv_reader(f)
+            header = next(reader, [])
+            kinds = [dialect.BaseDialect.INT] * len(header)
+            for row in islice(reader, self.sample_size):
+                for i, value in enumerate(row[:len(header)]):
+                    if value == '' or kinds[i] == dialect.BaseDialect.STRING:
+                        continue
+                    kinds[i] = max(kinds[i], self._csv_kind(value), key=self.CSV_KINDS.index)
+        return list(zip(header, kinds))
+
+    CSV_KINDS = [dialect.BaseDialect.INT, dialect.BaseDialect.FLOAT, dialect.BaseDialect.STRING]
+
+    @staticmethod
+    def _csv_kind(value):
+        for kind, func in [(dialect.BaseDialect.INT, int), (dialect.BaseDialect.FLOAT, float)]:
+            try:
+                func(value)
+                return kind
+            except ValueError:
+                pass
+        return dialect.BaseDialect.STRING
+
+    ARROW_TYPES = {
+        'bool': dialect.BaseDialect.BOOL,
+        'int8': dialect.BaseDialect.INT,
+        'int16': dialect.BaseDialect.INT,
+        'int32': dialect.BaseDialect.INT,
+        'uint8': dialect.BaseDialect.INT,
+        'uint16': dialect.BaseDialect.INT,
+        'int64': dialect.BaseDialect.LONG,
+        'uint32': dialect.BaseDialect.LONG,
+        'float': dialect.BaseDialect.FLOAT,
+        'double': dialect.BaseDialect.FLOAT,
+        'string': dialect.BaseDialect.STRING,
+        'large_string': dialect.BaseDialect.STRING,
+    }
+
+    def _parquet_columns(self):
+        schema = self.parquet.schema_arrow
+        return [
+            (field.name, self.ARROW_TYPES.get(str(field.type), str(field.type)))
+            for field in schema
+        ]
+
+    @property
+    def row_count(self):
+        """
+        Количество строк: для Parquet - из метаданных, для CSV - оценка
+        (_csv_row_count), по ней таблица выгружается потоково (Table.streaming)
+        """
+        if self.kind == PARQUET:
+            return self.parquet.metadata.num_rows
+        if self._row_count is None:
+            self._row_count = self._csv_row_count()
+        return self._row_count
+
+    def _csv_row_count(self):
+        """
+        Размер файла без заголовка, деленный на среднюю длину первых sample_size строк.
+        Если файл короче выборки, возвращается количество строк в нем
+        """
+        with open(self.path, 'rb') as f:
+            header = f.readline()
+            lines = list(islice(f, max(self.sample_size, 1)))
+            if not f.read(1):
+                return len(lines)
+        size = os.path.getsize(self.path) - len(header)
+        return round(size * len(lines) / sum(map(len, lines)))
+
+    def batches(self, columns, batch_size, ranges=()):
+        """
+        Порции строк (списки кортежей) с колонками columns
+        """
+        if self.kind == PARQUET:
+            return self._parquet_batches(columns, batch_size, ranges)
+        return self._csv_batches(columns, batch_size)
+
+    def _csv_batches(self, columns, batch_size):
+        names = self.names
+        converters = dict(self.columns)
+        idx = [names.index(name) for name in columns]
+        convert = [self.CONVERTERS[converters[name]] for name in columns]
+        with open(self.path, encoding=self.encoding, newline='') as f:
+            reader = self._csv_reader(f)
+            next(reader, None)
+            while True:
+                batch = [
+                    tuple(
+                        self._convert(func, row[i] if i < len(row) else '')
+                        for i, func in zip(idx, convert)
+                    )
+                    for row in islice(reader, batch_size)
+                ]
+                if not batch:
+                    return
+                yield batch
+
+    CONVERTERS = {
+        dialect.BaseDialect.INT: int,
+        dialect.BaseDialect.FLOAT: float,
+        dialect.BaseDialect.STRING: str,
+    }
+
+    @staticmethod
+    def _convert(func, value):
+        if value == '':
+            return None
+        try:
+            return func(value)
+        except ValueError:
+            # Тип определен по первым строкам, остальные значения
+            # сохраняются как есть (SQLite допускает разные типы в колонке)
+            return value
+
+    def _parquet_batches(self, columns, batch_size, ranges):
+        parquet = self.parquet
+        metadata = parquet.metadata
+        names = self.names
+        for group in range(metadata.num_row_groups):
+            if self._skip_row_group(metadata.row_group(group), names, ranges):
+                self.logger.debug('Skip row group %s of %s', group, self.path)
+                continue
+            table = parquet.read_row_group(group, columns=columns)
+            for batch in table.to_batches(batch_size):
+                data = [batch.column(i).to_pylist() for i in range(batch.num_columns)]
+                yield list(zip(*data))
+
+    @staticmethod
+    def _skip_row_group(row_group, names, ranges):
+        for name, op, value in ranges:
+            statistics = row_group.column(names.index(name)).statistics
+            if statistics is None:
+                continue
+            if statistics.null_count == row_group.num_rows:
+                # Сравнение с NULL не бывает истинным
+                return True
+            if not statistics.has_min_max:
+                continue
+            lo, hi = statistics.min, statistics.max
+            if isinstance(value, str) != isinstance(lo, str) or isinstance(lo, bytes):
+                continue
+            if OP_PRUNE[op](lo, hi, value):
+                return True
+        return False
+
+
+class FileConnection:
+    def __init__(self, path, **options):
+        self.path = path
+        self.options = options
+        self._tables = {}
+
+    def table(self, schema, table):
+        """
+        FileTable или None, если файл не найден
+        """
+        key = (schema, table)
+        if key not in self._tables:
+            file_table = None
+            for kind in (CSV, PARQUET):
+                path = os.path.join(self.path, schema, '{}.{}'.format(table, kind))
+                if os.path.isfile(path):
+                    file_table = FileTable(path, kind, **self.options)
+                    break
+            self._tables[key] = file_table
+        return self._tables[key]
+
+    def cursor(self):
+        return FileCursor(self)
+
+    def close(self):
+        self._tables = {}
+
+
+class FileCursor:
+    """
+    Курсор, выполняющий запросы, которые генерирует structures.Table:
+    SELECT <колонки> FROM "schema"."table" [WHERE ...] [LIMIT n]
+    """
+    BATCH_SIZE = 10000
+    FROM_REGEXP = re.compile(r'\sFROM\s+"((?:[^"]|"")+)"\."((?:[^"]|"")+)"', re.IGNORECASE)
+    IDENTIFIER_REGEXP = re.compile(r'"((?:[^"]|"")+)"')
+    WHERE_REGEXP = re.compile(r'\sWHERE\s', re.IGNORECASE)
+    LIMIT_REGEXP = re.compile(r'\sLIMIT\s+(\d+)\s*$', re.IGNORECASE)
+
+    def __init__(self, connection: FileConnection):
+        self.connection = connection
+        self.description = None
+        self._rows = iter(())
+        self._sqlite = None
+        self._cancelled = False
+
+    def execute(self, query, ranges=()):
+        """
+        ranges - условия [(колонка, оператор, значение), ...]
+        для пропуска групп строк Parquet
+        """
+        self._cancelled = False
+        match = self.FROM_REGEXP.search(query)
+        if match is None:
+            raise ValueError('Unsupported query for file source: {}'.format(query))
+        schema, table = [name.replace('""', '"') for name in match.groups()]
+        file_table = self.connection.table(schema, table)
+        if file_table is None:
+            raise FileNotFoundError('Table {}.{} not found in {}'.format(schema, table, self.connection.path))
+
+        select_list = query[:match.start()]
+        is_star = '*' in select_list
+        if is_star:
+            columns = file_table.names
+        else:
+            identifiers = {
+                name.replace('""', '"')
+                for name in self.IDENTIFIER_REGEXP.findall(query)
+            }
+            columns = [name for name in file_table.names if name in identifiers]
+        limit = self.LIMIT_REGEXP.search(query)
+        limit = limit and int(limit.group(1))
+
+        batches = file_table.batches(columns, self.BATCH_SIZE, ranges)
+        if self.WHERE_REGEXP.search(query):
+            rows = self._filter(batches, query, schema, table, columns)
+        else:
+            # Без условий достаточно выбрать нужные колонки в порядке запроса
+            selected = None if is_star else [
+                columns.index(name.replace('""', '"'))
+                for name in self.IDENTIFIER_REGEXP.findall(select_list)
+            ]
+            if selected == list(range(len(columns))):
+                selected = None
+            rows = self._project(batches, selected)
+        if limit is not None:
+            rows = islice(rows, limit)
+        self._rows = rows
+        self.description = [(name,) for name in columns]
+        return self
+
+    def _project(self, batches, selected):
+        for batch in batches:
+            if self._cancelled:
+                return
+            if selected is None:
+                yield from batch
+            else:
+                for row in batch:
+                    yield tuple(row[i] for i in selected)
+
+    def _filter(self, batches, query, schema, table, columns):
+        """
+        Каждая порция загружается во временную таблицу SQLite
+        с тем же именем, после чего к ней выполняется исходный запрос
+        """
+        conn = self.sqlite
+        if schema != 'main':
+            attached = {name for _, name, _ in conn.execute('PRAGMA database_list')}
+            if schema not in attached:
+                conn.execute('ATTACH DATABASE \':memory:\' AS {}'.format(quote(schema)))
+        name = '{}.{}'.format(quote(schema), quote(table))
+        conn.execute('DROP TABLE IF EXISTS {}'.format(name))
+        conn.execute('CREATE TABLE {} ({})'.format(name, ', '.join(quote(column) for column in columns)))
+        insert = 'INSERT INTO {} VALUES ({})'.format(name, ', '.join(['?'] * len(columns)))
+        for batch in batches:
+            if self._cancelled:
+                return
+            conn.execute('DELETE FROM {}'.format(name))
+            conn.executemany(insert, batch)
+            yield from conn.execute(query).fetchall()
+
+    @property
+    def sqlite(self):
+        if self._sqlite is None:
+            self._sqlite = sqlite3.connect(':memory:', check_same_thread=False)
+        return self._sqlite
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=1):
+        return list(islice(self._rows, size))
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def cancel(self):
+        self._cancelled = True
+        if self._sqlite is not None:
+            self._sqlite.interrupt()
+
+    def close(self):
+        self._rows = iter(())
+        if self._sqlite is not None:
+            self._sqlite.close()
+            self._sqlite = None
+
+
+class Files(dialect.BaseDialect):
+    """
+    Каталоги с файлами CSV и Parquet
+    """
+    logger = logging.getLogger('files_dialect')
+    PARTITIONED = False
+
+    def __init__(self, path, sample_size=1000, delimiter=',', encoding='utf-8'):
+        super().__init__(None, None, None, None)
+        self.path = path
+        self.options = dict(sample_size=sample_size, delimiter=delimiter, encoding=encoding)
+
+    def conn_str(self, database, stream=False):
+        return os.path.join(self.path, database)
+
+    def connect(self, database, login_timeout=None, timeout=None, stream=False):
+        path = self.conn_str(database)
+        if not os.path.isdir(path):
+            raise FileNotFoundError('Database directory {} not found'.format(path))
+        return FileConnection(path, **self.options)
+
+    def cancel(self, connection, cursor):
+        cursor.cancel()
+
+    def execute(self, cursor, table, select_query):
+        return cursor.execute(select_query, self.ranges(table.filters))
+
+    def all_schemas(self, cursor):
+        path = cursor.connection.path
+        return sorted(
+            name
+            for name in os.listdir(path)
+            if os.path.isdir(os.path.join(path, name))
+        )
+
+    def all_tables(self, cursor, schema):
+        path = os.path.join(cursor.connection.path, schema)
+        return sorted(
+            name
+            for file_name in os.listdir(path)
+            for name, ext in [os.path.splitext(file_name)]
+            if ext[1:] in (CSV, PARQUET)
+        )
+
+    def all_columns(self, cursor, schema, table):
+        file_table = cursor.connection.table(schema, table)
+        if file_table is None:
+            return []
+        return [
+            (name, True, dtype, None, None, dtype in self.BASE_TYPE_TO_SQLITE_TYPE)
+            for name, dtype in file_table.columns
+        ]
+
+    def row_count(self, cursor, schema, table):
+        file_table = cursor.connection.table(schema, table)
+        return file_table and file_table.row_count
+
+    @classmethod
+    def ranges(cls, filters):
+        """
+        Условия вида <колонка> <оператор> <константа>,
+        входящие в конъюнкцию filters
+        """
+        result = []
+        stack = list(filters)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, expr.And):
+                stack.extend(node.args)
+            elif isinstance(node, expr.Is) and node.right is True:
+                stack.append(node.left)
+            elif isinstance(node, expr.SimpleExpression):
+                stack.append(node.expr)
+            elif isinstance(node, expr.ComparisonPredicate) and node.op in OP_PRUNE:
+                left, right, op = node.left, node.right, node.op
+                if isinstance(left, (expr.PrimaryNumeric, expr.Str)):
+                    left, right = right, left
+                    op = expr.ComparisonPredicate.MAP_REVERSE.get(op, op)
+                if (
+                        not isinstance(left, expr.BaseExpression)
+                        and hasattr(left, 'table')
+                        and isinstance(right, (expr.PrimaryNumeric, expr.Str))
+                ):
+                    result.append((left.name, op, right.value))
+        return result
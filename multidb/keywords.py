@@ -51,7 +51,8 @@ __all__ = ['ABS', 'ABSOLUTE', 'ACTION', 'ADA', 'ADD', 'ADMIN', 'AFTER', 'AGGREGA
            'USER_DEFINED_TYPE_NAME', 'USER_DEFINED_TYPE_SCHEMA', 'USING', 'VALUE', 'VALUES', 'VARCHAR', 'VARIABLE',
            'VARYING', 'VIEW', 'WHEN', 'WHENEVER', 'WHERE', 'WITH', 'WITHOUT', 'WORK', 'WRITE', 'YEAR', 'ZONE',
 
-           'INDEX', 'IF', 'NULLS', 'INCLUDE', 'TABLESPACE', 'BTREE', 'HASH', 'GIST', 'SPGIST', 'GIN', 'BRIN']
+           'INDEX', 'IF', 'NULLS', 'INCLUDE', 'TABLESPACE', 'BTREE', 'HASH', 'GIST', 'SPGIST', 'GIN', 'BRIN',
+           'EXPLAIN', 'ANALYZE', 'MATERIALIZED', 'REFRESH']
 
 # Ключевые слова взяты из стандарта SQL 1999
 NON_RESERVED_WORDS = {
@@ -110,6 +111,9 @@ NON_RESERVED_WORDS = {
 
     # FOR PARSE INDEX
     'INDEX', 'IF', 'INCLUDE', 'TABLESPACE', 'BTREE', 'HASH', 'GIST', 'SPGIST', 'GIN', 'BRIN',
+
+    # MULTIDB
+    'EXPLAIN', 'ANALYZE', 'MATERIALIZED', 'REFRESH',
 }
 
 RESERVED_WORDS = {
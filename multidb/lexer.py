@@ -1,4 +1,5 @@
 import logging
+import re
 
 from . import _logger
 from . import token as tk
@@ -9,35 +10,46 @@ logger.display_position()
 
 
 class Position:
+    """
+    Позиция в тексте запроса. Хранится только смещение idx,
+    строка и колонка вычисляются по требованию (для сообщений)
+    """
+    __slots__ = ('_text', 'n', 'idx')
+
     END_CHAR = '\000'
+    SPACE_REGEXP = re.compile(r'\s*')
 
-    def __init__(self, text, n=None, idx=None, row=None, col=None):
+    def __init__(self, text, n=None, idx=None):
         self._text = text
         self.n = n or len(text)
         self.idx = idx or 0
-        self.row = row or 1
-        self.col = col or 1
 
     @property
     def text(self):
         return self._text[self.idx:]
 
+    @property
+    def source(self):
+        return self._text
+
+    @property
+    def row(self):
+        return self._text.count('\n', 0, self.idx) + 1
+
+    @property
+    def col(self):
+        return self.idx - self._text.rfind('\n', 0, self.idx)
+
     @property
     def char(self):
         return self._text[self.idx] if self.idx < self.n else self.END_CHAR
 
     def next(self):
-        if self.char == '\n':
-            self.row += 1
-            self.col = 1
-        else:
-            self.col += 1
         self.idx = self.idx + 1 if self.idx < self.n else self.idx
 
     def nextn(self, n):
         assert n > 0
-        for _ in range(n):
-            self.next()
+        self.idx = min(self.idx + n, self.n)
 
     @property
     def isspace(self):
@@ -48,14 +60,13 @@ class Position:
         return self.idx == self.n
 
     def skip_space(self):
-        while self.isspace:
-            self.next()
+        self.idx = self.SPACE_REGEXP.match(self._text, self.idx).end()
 
     def __sub__(self, other):
         return self._text[other.idx:self.idx]
 
     def __copy__(self):
-        return Position(self._text, self.n, self.idx, self.row, self.col)
+        return Position(self._text, self.n, self.idx)
 
     def copy(self):
         return self.__copy__()
@@ -65,47 +76,32 @@ class Position:
 
 
 class Interval:
-    def __init__(self, start=None, end=None):
-        self._start = start and start.copy()
-        self._end = end and start.copy()
+    """
+    Участок текста запроса [start, end), start и end - смещения
+    """
+    __slots__ = ('text', 'start', 'end')
 
-    @property
-    def start(self):
-        return self._start
-
-    @start.setter
-    def start(self, value: Position):
-        self._start = value.copy()
+    def __init__(self, text, start=0, end=0):
+        self.text = text
+        self.start = start
+        self.end = end
 
-    @start.deleter
-    def start(self):
-        self._start = None
-
-    @property
-    def end(self):
-        return self._end
-
-    @end.setter
-    def end(self, value: Position):
-        self._end = value.copy()
-
-    @end.deleter
-    def end(self):
-        self._end = None
+    def position(self, idx):
+        return Position(self.text, idx=idx)
 
     def __str__(self):
-        assert self._start and self._end
-        return self.end - self.start
+        return self.text[self.start:self.end]
 
     def __repr__(self):
-        assert self._start and self._end
-        return '[{}-{}]'.format(self._start, self._end)
+        return '[{}-{}]'.format(self.position(self.start), self.position(self.end))
 
 
-EMPTY_INTERVAL = Interval(Position(''), Position(''))
+EMPTY_INTERVAL = Interval('')
 
 
 class Lexer:
+    __slots__ = ('pos', 'interval', 'last_interval', 'current_tokens')
+
     TOKENS = [
         tk.IntToken,
         tk.FloatToken,
@@ -127,32 +123,33 @@ class Lexer:
     def next(self):
         old_token = self.current_tokens
         self.current_tokens = self.parse()
-        logger.current_token.debug(repr(self.current_tokens))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.current_token.debug('%r', self.current_tokens)
         return old_token
 
     def get_matches(self):
-        start = self.pos.copy()
-        return start, sorted((
-            (t, t.match(start))
+        return self.pos.idx, sorted((
+            (t, t.match(self.pos))
             for t in self.TOKENS
         ), key=lambda x: x[1][0], reverse=True)
 
     def parse(self):
-        self.pos.skip_space()
-        while not self.pos.is_end:
-            self.last_interval, self.interval = self.interval, Interval()
+        pos = self.pos
+        pos.skip_space()
+        while not pos.is_end:
+            self.last_interval = self.interval
 
-            self.interval.start, matches = self.get_matches()
+            start, matches = self.get_matches()
             max_size = matches[0][1][0]
 
             if not max_size:
-                while not self.pos.isspace and not self.pos.is_end:
-                    self.pos.next()
-                self.interval.end = self.pos.copy()
+                while not pos.isspace and not pos.is_end:
+                    pos.next()
+                self.interval = Interval(pos.source, start, pos.idx)
                 logger.current_token.error('Wrong sequences: %s', str(self.interval))
             else:
-                self.pos.nextn(max_size)
-                self.interval.end = self.pos.copy()
+                pos.nextn(max_size)
+                self.interval = Interval(pos.source, start, pos.idx)
                 tokens = tuple(
                     t(match, self.interval)
                     for t, (size, match) in matches
@@ -166,7 +163,7 @@ class Lexer:
                     )
                 return tokens
 
-            self.pos.skip_space()
+            pos.skip_space()
 
         return [tk.EndToken()]
 
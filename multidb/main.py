@@ -1,108 +1,536 @@
+import contextvars
+import logging
 import re
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import yaml
 
-from . import _logger
+from . import dml
+from . import encoding
+from . import export
+from . import profiling
 from . import structures as st
+from .cache import StagingCache
+from .context import QueryContext
 from .parser import SQLParser
+from .profiling import Profile
+from .result import ResultCursor
 import os
 
 
 class ControlCenter:
+    logger = logging.getLogger('control_center')
+
     USE_REGEXP = re.compile(
-        r'^\s+use\s+([a-zA-Z_][a-zA-Z0-9_. ]*)\s+as\s+([a-zA-Z_][a-zA-Z0-9_]*)\s+$',
+        r'^\s*use\s+([a-zA-Z_][a-zA-Z0-9_. ]*)\s+as\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*$',
         re.IGNORECASE
     )
+    # Вид псевдонима USE по количеству частей имени
+    ALIAS_KINDS = ('dbms', 'db', 'schema', 'table')
     EXIT_REGEXP = re.compile(r'^\s*exit\s*$', re.IGNORECASE)
+    # Ключ config.yaml с настройками, все остальные ключи - источники
+    SETTINGS_KEY = 'multidb'
+    # Размер порции при потоковой выгрузке таблицы
+    STREAM_BATCH_SIZE = 10000
+    # Источник с материализованными представлениями (таблицы кэша),
+    # совпадает с SETTINGS_KEY, поэтому не пересекается с источниками из config.yaml
+    MATERIALIZED_SOURCE = SETTINGS_KEY
+    MATERIALIZED_DB = 'cache'
+    DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
 
     def __init__(self, path_to_config):
         with open(path_to_config, encoding='utf-8') as f:
             self.raw_data = yaml.safe_load(f)
+        self.settings = self.raw_data.pop(self.SETTINGS_KEY, None) or {}
+        # Ограничение времени выполнения одного запроса, в секундах
+        self.query_timeout = self.settings.get('query_timeout')
+        # Подсчет объема переданных данных в профиле запроса
+        self.profile_bytes = self.settings.get('profile_bytes', False)
+        # Кэш таблиц с водяными знаками: файл SQLite (по умолчанию временный)
+        self.cache = StagingCache(self.settings.get('cache'))
+        # Срок хранения выгрузок таблиц в кэше, в секундах (None - не сохраняются).
+        # Выгрузка, содержащая все строки и колонки новой, используется вместо запроса к источнику
+        self.extract_ttl = self.settings.get('extract_ttl')
+        # Строковые колонки с долей различных значений не больше dictionary_ratio
+        # хранятся в SQLite в виде кодов словаря (None - не кодируются)
+        self.dictionary_ratio = self.settings.get('dictionary_ratio', encoding.DEFAULT_RATIO)
+        # Объем SQLite запроса в памяти, МиБ, после которого база
+        # переносится во временный файл (None - без ограничения)
+        memory_limit = self.settings.get('memory_limit')
+        self.memory_limit = int(memory_limit * 1024 * 1024) if memory_limit is not None else None
+        # Каталог для SQLite запросов в файлах вместо памяти (None - в памяти)
+        self.staging_dir = self.settings.get('staging_dir')
+        # Объем файла SQLite, читаемый через mmap, байт
+        self.mmap_size = self.settings.get('mmap_size', self.DEFAULT_MMAP_SIZE)
         self.sources = {
             name: st.DBMS(name, connection_data)
             for name, connection_data in self.raw_data.items()
         }
+        self.sources[self.MATERIALIZED_SOURCE] = st.DBMS(self.MATERIALIZED_SOURCE, dict(
+            type='sqlite',
+            path=self.cache.uri.replace('{', '{{').replace('}', '}}'),
+            uri=True,
+        ))
 
         self.local_alias = dict(dbms={}, db={}, schema={}, table={})
-        self._sqlite_conn = sqlite3.connect(':memory:')
 
-    def reconnect(self):
-        if self._sqlite_conn:
-            self._sqlite_conn.close()
-        self._sqlite_conn = sqlite3.connect(':memory:')
+        # Контекст последнего запроса, выполненного без явного контекста
+        self._last_context = None
+        self._lock = threading.Lock()
 
-    def execute(self, query):
-        _logger.ParserLogger.is_crashed = False
-        _logger.ParserLogger.errors = []
+        # Таймеры обновления материализованных представлений: name -> Timer
+        self._timers = {}
+        for name, (_, refresh_every) in self.cache.materialized().items():
+            self._register(name, refresh_every)
 
-        parser = SQLParser.build(query)
-        parser.set_cc(self)
+    def use(self, command):
+        """
+        USE <dbms>[.<db>[.<schema>[.<table>]]] AS <alias> - псевдоним,
+        по которому в запросах можно сокращать имена таблиц.
+        False, если command не является командой USE
+        """
+        match = self.USE_REGEXP.match(command)
+        if not match:
+            return False
+        name = [part.strip() for part in match.group(1).split('.')]
+        if len(name) > len(self.ALIAS_KINDS) or not all(name):
+            raise ValueError('Wrong name in USE: {}'.format(match.group(1)))
+        kind = self.ALIAS_KINDS[len(name) - 1]
+        self.local_alias[kind][match.group(2)] = name[0] if kind == 'dbms' else tuple(name)
+        return True
 
-        try:
-            select = parser.program()
-        except Exception as ex:
-            err = '\n'.join(_logger.ParserLogger.errors + ['{}({})'.format(ex.__class__.__name__, str(ex))])
-            return err, None
-
-        if _logger.ParserLogger.is_crashed:
-            return '\n'.join(_logger.ParserLogger.errors), None
+    def session(self):
+        """
+        Новый контекст выполнения. Один контекст выполняет
+        не более одного запроса одновременно
+        """
+        return QueryContext(self)
 
+    def execute(self, query, ctx=None, batch_size=ResultCursor.DEFAULT_BATCH_SIZE, timeout=None):
+        """
+        Результат запроса возвращается в виде ResultCursor.
+        Если контекст не передан, то он создается для запроса
+        и закрывается вместе с курсором.
+        Запрос можно прервать из другого потока через ctx.cancel()
+        """
+        own_context = ctx is None
+        ctx = ctx or self.session()
+        ctx.begin(timeout or self.query_timeout)
         try:
-            select.validate()
-            view_sql = select.get_sql()
-        except Exception as ex:
-            err = '\n'.join(_logger.ParserLogger.errors + ['{}({})'.format(ex.__class__.__name__, str(ex))])
-            return err, None
-
-        if _logger.ParserLogger.is_crashed:
-            return '\n'.join(_logger.ParserLogger.errors), None
+            with ctx:
+                err, data = self._execute(query, ctx, batch_size, own_context)
+        finally:
+            ctx.finish()
+            ctx.release()
+        if own_context:
+            if err:
+                ctx.close()
+            else:
+                with self._lock:
+                    self._last_context = ctx
+        return err, data
 
-        self.reconnect()
-        cursor = self._sqlite_conn.cursor()
+    def _execute(self, query, ctx, batch_size, own_context):
+        err, statement, view_sql = self._prepare(query, ctx)
+        if err:
+            return err, None
+        return self._run(ctx, statement, view_sql, batch_size, own_context)
 
+    def _run(self, ctx, statement, view_sql, batch_size, own_context):
+        if isinstance(statement, dml.MaterializedView) and statement.select is None:
+            return self._run_materialized(ctx, statement, batch_size, own_context)
+        explain = statement if isinstance(statement, dml.Explain) else None
         try:
+            ctx.check()
+            if isinstance(statement, dml.MaterializedView) and statement.action == dml.MaterializedView.CREATE:
+                if statement.name in self.cache.materialized():
+                    raise ValueError('Materialized view {} already exists'.format(statement.name))
+            ctx.reconnect()
+
             create_queries = []
             select_queries = []
             insert_queries = []
-            for lvl in select.full_table_list:
-                for table in lvl:
-                    create_query = table.create_query.get_sql()
-                    create_queries.append(create_query)
-                    cursor.execute(create_query)
-                    self._sqlite_conn.commit()
+            view_query = None
+            if explain is None or explain.analyze:
+                for table in statement.tables:
+                    create_queries.append(self._create_table(ctx, table))
 
                     select_query = table.select_query.get_sql()
                     select_queries.append(select_query)
-                    table.cursor.execute(select_query)
-
-                    insert_query = table.insert_query
-                    insert_queries.append(insert_query)
-                    cursor.executemany(insert_query, table.cursor.fetchall())
-                    self._sqlite_conn.commit()
-
-            view_query = 'CREATE VIEW result AS {}'.format(view_sql)
-            cursor.execute(view_query)
-            self._sqlite_conn.commit()
-            cursor.execute('SELECT * FROM result limit 100')
-            data = cursor.fetchall()
-            header = select.result_columns
-            return None, (create_queries, select_queries, insert_queries, view_query, (data, header))
+                    insert_queries.append(table.insert_query)
+                    if table.watermark is not None:
+                        self._refresh(ctx, table)
+                    elif not self._load_extract(ctx, table):
+                        if table.streaming:
+                            self._stream(ctx, table, select_query)
+                        else:
+                            rows = self._extract(table, select_query)
+                            self._load(ctx, table, rows)
+                        self._save_extract(ctx, table)
+
+                view_query = self._create_view(ctx, self._view_sql(statement, view_sql))
+                if isinstance(statement, dml.MaterializedView):
+                    self._materialize(ctx, statement)
+            else:
+                select_queries = [
+                    table.select_query.get_sql()
+                    for table in statement.tables
+                ]
+            if explain is not None:
+                self._explain(ctx, explain)
+            ctx.check()
         except Exception as ex:
-            return str(ex), None
+            return str(ctx.cancelled or ex), None
+        result = self._result(ctx, statement, batch_size, own_context)
+        return None, (create_queries, select_queries, insert_queries, view_query, result)
+
+    def _run_materialized(self, ctx, statement, batch_size, own_context):
+        """
+        REFRESH и DROP MATERIALIZED VIEW
+        """
+        view = self.cache.materialized().get(statement.name)
+        if view is None:
+            return 'Materialized view {} not found'.format(statement.name), None
+        query, refresh_every = view
+
+        if statement.action == dml.MaterializedView.REFRESH:
+            err, select, view_sql = self._prepare(query, ctx)
+            if err:
+                return err, None
+            statement = dml.MaterializedView(statement.action, statement.name, select, query, refresh_every)
+            return self._run(ctx, statement, view_sql, batch_size, own_context)
+
+        try:
+            ctx.check()
+            ctx.reconnect()
+            self._unregister(statement.name)
+            with self.cache.lock(statement.name):
+                self.cache.drop_materialized(statement.name)
+            self._status(ctx, 'DROP MATERIALIZED VIEW')
+        except Exception as ex:
+            return str(ctx.cancelled or ex), None
+        result = self._result(ctx, statement, batch_size, own_context)
+        return None, ([], [], [], None, result)
+
+    @staticmethod
+    def _result(ctx, statement, batch_size, own_context):
+        """
+        Курсор по представлению result, заголовок и типы колонок
+        запоминаются в контексте для выгрузки результата (export_result)
+        """
+        ctx.result_columns = statement.result_columns
+        ctx.result_types = statement.result_types
+        return ResultCursor(ctx, ctx.result_columns, batch_size, own_context, ctx.result_types)
+
+    def _materialize(self, ctx, statement):
+        with self.cache.lock(statement.name):
+            self.cache.materialize(
+                ctx, statement.name, statement.query, statement.refresh_every, statement.result_names
+            )
+        if statement.action == dml.MaterializedView.CREATE:
+            self._register(statement.name, statement.refresh_every)
+
+    def _register(self, name, refresh_every):
+        """
+        Делает представление доступным по короткому имени
+        и запускает его периодическое обновление
+        """
+        self.local_alias['table'][name] = (self.MATERIALIZED_SOURCE, self.MATERIALIZED_DB, 'main', name)
+        if refresh_every:
+            self._schedule(name, refresh_every)
+
+    def _unregister(self, name):
+        self.local_alias['table'].pop(name, None)
+        with self._lock:
+            timer = self._timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _schedule(self, name, seconds):
+        timer = threading.Timer(seconds, self._scheduled_refresh, (name, seconds))
+        timer.daemon = True
+        with self._lock:
+            self._timers[name] = timer
+        timer.start()
+
+    def _scheduled_refresh(self, name, seconds):
+        # Таймер мог быть отменен (DROP, close) или заменен во время ожидания
+        with self._lock:
+            if self._timers.get(name) is not threading.current_thread():
+                return
+        err = self.refresh_materialized(name)
+        if err:
+            self.logger.error('Refresh materialized view %s failed: %s', name, err)
+        with self._lock:
+            if self._timers.get(name) is not threading.current_thread():
+                return
+        self._schedule(name, seconds)
+
+    def refresh_materialized(self, name, timeout=None):
+        """
+        Обновляет материализованное представление,
+        возвращает текст ошибки или None
+        """
+        ctx = self.session()
+        try:
+            err, data = self.execute('REFRESH MATERIALIZED VIEW {}'.format(name), ctx, timeout=timeout)
+            if data is not None:
+                data[-1].close()
+            return err
         finally:
-            cursor.close()
+            ctx.close()
+
+    def close(self):
+        """
+        Останавливает обновление материализованных представлений,
+        закрывает соединения диалектов и кэш
+        """
+        with self._lock:
+            timers, self._timers = self._timers, {}
+        for timer in timers.values():
+            timer.cancel()
+        for dbms in self.sources.values():
+            dbms.dialect.close()
+        self.cache.close()
+
+    def _prepare(self, query, ctx):
+        """
+        Разбор и проверка запроса, генерация SQL для представления result
+        """
+        parser = SQLParser.build(query)
+        parser.set_cc(self)
+
+        try:
+            with ctx.profile.stage(Profile.PARSE):
+                select = parser.program()
+        except Exception as ex:
+            return self._error(ctx, ex), None, None
+
+        if ctx.is_crashed:
+            return '\n'.join(ctx.errors), None, None
 
-    def save_result(self, path):
         try:
-            self._sqlite_conn.execute('select 1')
+            with ctx.profile.stage(Profile.VALIDATE):
+                select.validate()
+                view_sql = select.get_sql()
+        except Exception as ex:
+            return self._error(ctx, ex), None, None
+
+        if ctx.is_crashed:
+            return '\n'.join(ctx.errors), None, None
+        return None, select, view_sql
+
+    @staticmethod
+    def _error(ctx, ex):
+        ex = ctx.cancelled or ex
+        return '\n'.join(ctx.errors + ['{}({})'.format(ex.__class__.__name__, str(ex))])
+
+    @staticmethod
+    def _create_table(ctx, table):
+        create_query = table.create_query.get_sql()
+        with ctx.profile.stage(Profile.CREATE, table.source_name):
+            ctx.sqlite_conn.execute(create_query)
+            ctx.sqlite_conn.commit()
+        return create_query
+
+    @staticmethod
+    def _query(table, select_query, cursor=None):
+        ctx = table.context
+        ctx.check()
+        with ctx.profile.stage(Profile.EXECUTE, table.source_name):
+            return table.execute(select_query, cursor)
+
+    @classmethod
+    def _extract(cls, table, select_query):
+        ctx = table.context
+        cursor = cls._query(table, select_query)
+        with ctx.profile.stage(Profile.FETCH, table.source_name) as stage:
+            rows = cursor.fetchall()
+            stage.add_rows(len(rows), ctx.profile.size(rows))
+        return rows
+
+    @classmethod
+    def _load(cls, ctx, table, rows):
+        ctx.check()
+        with ctx.profile.stage(Profile.INSERT, table.source_name) as stage:
+            cls._insert(ctx, table, rows)
+            stage.add_rows(len(rows))
+
+    @classmethod
+    def _stream(cls, ctx, table, select_query, cursor=None):
+        """
+        Выгрузка и загрузка таблицы порциями по STREAM_BATCH_SIZE строк,
+        в памяти находится не более одной порции.
+        Если таблица разбита на диапазоны (Table.partitions),
+        то диапазоны выгружаются параллельно
+        """
+        if cursor is None and table.partitions:
+            return cls._stream_partitions(ctx, table)
+        cursor = cls._query(table, select_query, cursor)
+        fetch = ctx.profile.begin(Profile.FETCH, table.source_name)
+        insert = ctx.profile.begin(Profile.INSERT, table.source_name)
+        while True:
+            ctx.check()
+            with profiling.StageTimer(fetch):
+                rows = cursor.fetchmany(cls.STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            fetch.add_rows(len(rows), ctx.profile.size(rows))
+            with profiling.StageTimer(insert):
+                cls._insert(ctx, table, rows)
+            insert.add_rows(len(rows))
+
+    @staticmethod
+    def _insert(ctx, table, rows):
+        with ctx.sqlite_lock:
+            # При прерывании (sqlite3.Connection.interrupt) транзакция откатывается
+            with ctx.sqlite_conn:
+                ctx.sqlite_conn.executemany(table.insert_query, encoding.encode(ctx, table, rows))
+            ctx.check_memory()
+
+    def _refresh(self, ctx, table):
+        """
+        Инкрементальное обновление копии таблицы в кэше
+        и загрузка данных для запроса из нее
+        """
+        with self.cache.lock(self.cache.table_name(table)):
+            self.cache.refresh(table, table.watermark, self.STREAM_BATCH_SIZE)
+            ctx.check()
+            self.cache.load(ctx, table)
+
+    def _caches_extracts(self, table):
+        return self.extract_ttl is not None and table.dbms.name != self.MATERIALIZED_SOURCE
+
+    def _load_extract(self, ctx, table):
+        """
+        Загрузка таблицы из сохраненной выгрузки вместо запроса к источнику.
+        False, если подходящей выгрузки нет
+        """
+        if not self._caches_extracts(table):
+            return False
+        ctx.check()
+        return self.cache.load_extract(ctx, table, self.extract_ttl) is not None
+
+    def _save_extract(self, ctx, table):
+        if self._caches_extracts(table):
+            ctx.check()
+            self.cache.save_extract(ctx, table, self.extract_ttl)
+
+    @classmethod
+    def _stream_partitions(cls, ctx, table):
+        stream = bool(table.dbms.dialect.STREAM_OPTIONS)
+        with ThreadPoolExecutor(len(table.partitions), thread_name_prefix='multidb_partition') as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    cls._stream, ctx, table, query, table.open_cursor(stream)
+                )
+                for query in table.partitions
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                # Остальные диапазоны этой таблицы прерываются
+                table.cancel()
+                raise
+
+    @staticmethod
+    def _explain(ctx, explain):
+        """
+        Заменяет представление result планом запроса
+        """
+        actual = explain.analyze_nodes(ctx.sqlite_conn) if explain.analyze else None
+        lines = explain.plan(actual, ctx.profile if explain.analyze else None)
+        with ctx.sqlite_conn:
+            ctx.sqlite_conn.execute('DROP VIEW IF EXISTS result')
+            ctx.sqlite_conn.execute('CREATE TABLE explain_plan (line varchar)')
+            ctx.sqlite_conn.executemany('INSERT INTO explain_plan VALUES (?)', [(line,) for line in lines])
+            ctx.sqlite_conn.execute('CREATE VIEW result AS SELECT line FROM explain_plan')
+
+    @staticmethod
+    def _status(ctx, status):
+        """
+        Представление result из одной строки с результатом команды
+        """
+        with ctx.sqlite_conn:
+            ctx.sqlite_conn.execute('CREATE TABLE status (status varchar)')
+            ctx.sqlite_conn.execute('INSERT INTO status VALUES (?)', (status,))
+            ctx.sqlite_conn.execute('CREATE VIEW result AS SELECT status FROM status')
+
+    @staticmethod
+    def _view_sql(statement, view_sql):
+        """
+        Текст представления result после загрузки таблиц:
+        закодированные при загрузке колонки декодируются в результате
+        """
+        if any(table.encoded_idx for table in statement.tables):
+            return statement.get_sql()
+        return view_sql
+
+    @staticmethod
+    def _create_view(ctx, view_sql):
+        view_query = 'CREATE VIEW result AS {}'.format(view_sql)
+        with ctx.profile.stage(Profile.VIEW):
+            ctx.sqlite_conn.execute(view_query)
+            ctx.sqlite_conn.commit()
+        return view_query
+
+    def save_result(self, path, ctx=None):
+        ctx = ctx or self._last_context
+        if ctx is None or ctx.sqlite_conn is None:
+            return 'Connection close'
+        try:
+            ctx.sqlite_conn.execute('select 1')
         except sqlite3.ProgrammingError:
             return 'Connection close'
         if os.path.isfile(path):
             return 'File is exists'
 
-        dump_conn = sqlite3.connect(path)
-        self._sqlite_conn.backup(dump_conn)
-        dump_conn.commit()
-        dump_conn.close()
+        # В файл копируется только результат запроса, без таблиц источников.
+        # Файл пишется через отдельное соединение: ATTACH/DETACH к соединению контекста
+        # невозможен, пока открыт недочитанный курсор результата (модель Qt читает порциями)
+        with ctx.sqlite_lock:
+            columns = ctx.sqlite_conn.execute("SELECT name, type FROM pragma_table_info('result')").fetchall()
+            source = ctx.sqlite_conn.execute('SELECT * FROM main.result')
+            target = sqlite3.connect(path)
+            try:
+                with target:
+                    target.execute('CREATE TABLE result ({})'.format(
+                        ', '.join('"{}" {}'.format(column.replace('"', '""'), dtype) for column, dtype in columns)
+                    ))
+                    insert = 'INSERT INTO result VALUES ({})'.format(', '.join('?' * len(columns)))
+                    while True:
+                        rows = source.fetchmany(self.STREAM_BATCH_SIZE)
+                        if not rows:
+                            break
+                        target.executemany(insert, rows)
+            finally:
+                source.close()
+                target.close()
+        return
+
+    def export_result(self, path, kind=None, compression=None, ctx=None):
+        """
+        Потоковая выгрузка результата запроса в CSV, Parquet или Arrow IPC
+        (export.export), формат по умолчанию определяется по расширению файла
+        """
+        ctx = ctx or self._last_context
+        if ctx is None or ctx.sqlite_conn is None:
+            return 'Connection close'
+        if os.path.isfile(path):
+            return 'File is exists'
+
+        result = ResultCursor(ctx, ctx.result_columns, types=ctx.result_types)
+        try:
+            export.export(result, path, kind, compression)
+        except sqlite3.ProgrammingError:
+            return 'Connection close'
+        except (ValueError, ImportError) as ex:
+            # Неизвестный формат или сжатие, не установлен pyarrow
+            return str(ex)
+        finally:
+            result.close()
         return
@@ -1,4 +1,6 @@
 class AsMixin:
+    __slots__ = ('short_name',)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.short_name = None
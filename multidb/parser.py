@@ -23,6 +23,8 @@ tree_logger.display_position()
 
 
 class CmpLexer(lexer.Lexer):
+    __slots__ = ('mode',)
+
     STRICT = 0
     SAFE = 1
     OPTIONAL = 2
@@ -136,14 +138,22 @@ class SQLParser(Parser):
         self.cc = cc
 
     def program(self):
-        #   <select>
+        #   <explain>
+        # | <materialized_view>
+        # | <select>
         # | <insert>
         # | <update>
         # | <delete>
         self.token.next()
 
         data = None
-        if self.token == kw.SELECT:
+        if self.token == kw.EXPLAIN:
+            data = self.explain()
+
+        elif self.token == (kw.CREATE, kw.REFRESH, kw.DROP):
+            data = self.materialized_view()
+
+        elif self.token == kw.SELECT:
             data = self.select()
 
         elif self.token == kw.INSERT:
@@ -158,6 +168,35 @@ class SQLParser(Parser):
         self.token >> tk.EndToken
         return data
 
+    @utils.log(tree_logger)
+    def explain(self):
+        # EXPLAIN [ ANALYZE ] <select>
+        self.token >> kw.EXPLAIN
+        analyze = bool(self.token.optional >> kw.ANALYZE)
+        return dml.Explain(self.select(), analyze)
+
+    @utils.log(tree_logger)
+    def materialized_view(self):
+        #   CREATE MATERIALIZED VIEW <name::ID> [ REFRESH EVERY <seconds::INT> ] AS <select>
+        # | REFRESH MATERIALIZED VIEW <name::ID>
+        # | DROP MATERIALIZED VIEW <name::ID>
+        action = self.token >> [kw.CREATE, kw.REFRESH, kw.DROP]
+        self.token >> kw.MATERIALIZED
+        self.token >> kw.VIEW
+        name = self.token >> tk.IdentifierToken
+        if action != dml.MaterializedView.CREATE:
+            return dml.MaterializedView(action, name)
+
+        refresh_every = None
+        if self.token.optional >> kw.REFRESH:
+            self.token >> kw.EVERY
+            refresh_every = self.token >> tk.IntToken
+        self.token >> kw.AS
+        # Текст запроса сохраняется для последующих обновлений
+        interval = self.token.interval
+        query = interval.text[interval.start:].strip().rstrip(';').rstrip()
+        return dml.MaterializedView(action, name, self.select(), query, refresh_every)
+
     @utils.log(tree_logger)
     def select(self):
         # SELECT <select_list> <table_expression>
@@ -654,6 +693,8 @@ class SQLParser(Parser):
 
 
 class PSQLCmpLexer(CmpLexer):
+    __slots__ = ()
+
     TOKENS = [
         tk.IntToken,
         tk.FloatToken,
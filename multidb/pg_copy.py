@@ -0,0 +1,227 @@
+"""
+Выгрузка данных из PostgreSQL через COPY (...) TO STDOUT.
+
+Используется нативный драйвер (psycopg 3 или psycopg2), данные
+передаются в текстовом формате COPY и разбираются сразу в кортежи
+со значениями нужных типов, минуя построчную выборку через ODBC
+"""
+import re
+
+try:
+    import psycopg
+except ImportError:  # pragma: no cover
+    psycopg = None
+
+try:
+    import psycopg2
+except ImportError:  # pragma: no cover
+    psycopg2 = None
+
+from .dialect import BaseDialect
+
+SQL_COPY = 'COPY ({query}) TO STDOUT'
+
+NULL = '\\N'
+ESCAPE_REGEXP = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))', re.DOTALL)
+ESCAPES = {
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v',
+}
+
+
+def is_available():
+    return psycopg is not None or psycopg2 is not None
+
+
+def is_unsupported(error):
+    """
+    Ошибка, после которой COPY в этой базе не используется: нет прав
+    или COPY не поддерживается (например, в пулере соединений).
+    Прочие ошибки (сеть, ошибка в запросе, отмена) - ошибки самого запроса
+    """
+    unsupported = tuple(
+        getattr(module.errors, name)
+        for module in (psycopg, psycopg2)
+        if module is not None and hasattr(module, 'errors')
+        for name in ('InsufficientPrivilege', 'FeatureNotSupported')
+        if hasattr(module.errors, name)
+    )
+    return isinstance(error, unsupported)
+
+
+def is_streaming():
+    """
+    Результат COPY читается порциями только через psycopg 3,
+    psycopg2 (copy_expert) получает его целиком
+    """
+    return psycopg is not None
+
+
+def _unescape_match(match):
+    octal, hexadecimal, char = match.groups()
+    if octal is not None:
+        return chr(int(octal, 8))
+    if hexadecimal is not None:
+        return chr(int(hexadecimal, 16))
+    return ESCAPES.get(char, char)
+
+
+def unescape(value):
+    if '\\' not in value:
+        return value
+    return ESCAPE_REGEXP.sub(_unescape_match, value)
+
+
+def _bool(value):
+    return value == 't'
+
+
+CONVERTERS = {
+    BaseDialect.BOOL: _bool,
+    BaseDialect.INT: int,
+    BaseDialect.LONG: int,
+    BaseDialect.FLOAT: float,
+    BaseDialect.STRING: unescape,
+}
+
+
+class TextDecoder:
+    """
+    Разбор потока в текстовом формате COPY: строки разделены \\n,
+    значения - табуляцией, NULL - \\N, спецсимволы экранированы
+    """
+
+    def __init__(self, dtypes, encoding='utf-8'):
+        self.converters = [CONVERTERS.get(dtype, unescape) for dtype in dtypes]
+        self.encoding = encoding
+        self._tail = b''
+
+    def decode_line(self, line):
+        return tuple(
+            None if value == NULL else convert(value)
+            for convert, value in zip(self.converters, line.split('\t'))
+        )
+
+    def feed(self, chunk):
+        """
+        Строки, полностью содержащиеся в прочитанных данных
+        """
+        data = self._tail + bytes(chunk)
+        end = data.rfind(b'\n')
+        if end < 0:
+            self._tail = data
+            return []
+        self._tail = data[end + 1:]
+        return [
+            self.decode_line(line)
+            for line in data[:end].decode(self.encoding).split('\n')
+        ]
+
+    def close(self):
+        if self._tail:
+            raise ValueError('Incomplete COPY row: {!r}'.format(self._tail[:100]))
+
+
+class CopyCursor:
+    """
+    Результат COPY с интерфейсом курсора (fetchmany, fetchall)
+    """
+
+    def __init__(self, conn, query, dtypes, release=None):
+        self.conn = conn
+        self.query = query
+        self.decoder = TextDecoder(dtypes)
+        # Возврат соединения в пул после полного чтения результата,
+        # при ошибке или незавершенном чтении соединение закрывается
+        self.release = release
+        self._done = False
+        self._rows = self._read()
+        self._buffer = []
+
+    def start(self):
+        """
+        Выполняет COPY и читает первую порцию, чтобы ошибка выполнения
+        (например, нет прав) возникла до начала выгрузки. Вызывается после
+        регистрации курсора в таблице (structures.Table.register_cursor),
+        чтобы отмена запроса и query_timeout прерывали и чтение первой порции
+        """
+        self._buffer = next(self._rows, [])
+        return self
+
+    def _read(self):
+        try:
+            if psycopg is not None and isinstance(self.conn, psycopg.Connection):
+                with self.conn.cursor() as cursor:
+                    with cursor.copy(SQL_COPY.format(query=self.query)) as copy:
+                        for chunk in copy:
+                            yield self.decoder.feed(chunk)
+            else:
+                # psycopg2 записывает весь результат в файловый объект,
+                # строки разбираются по мере поступления данных, но отдаются
+                # одной порцией (большие таблицы выгружаются через ODBC)
+                rows = []
+                writer = _Writer(lambda chunk: rows.extend(self.decoder.feed(chunk)))
+                with self.conn.cursor() as cursor:
+                    cursor.copy_expert(SQL_COPY.format(query=self.query), writer)
+                yield rows
+            self.decoder.close()
+            self._done = True
+        finally:
+            self.close()
+
+    def fetchmany(self, size):
+        while len(self._buffer) < size:
+            rows = next(self._rows, None)
+            if rows is None:
+                break
+            self._buffer.extend(rows)
+        rows, self._buffer = self._buffer[:size], self._buffer[size:]
+        return rows
+
+    def fetchall(self):
+        rows = self._buffer
+        self._buffer = []
+        for batch in self._rows:
+            rows.extend(batch)
+        return rows
+
+    def cancel(self):
+        conn = self.conn
+        if conn is not None:
+            conn.cancel()
+
+    def close(self):
+        conn, self.conn = self.conn, None
+        if conn is None or conn.closed:
+            return
+        if self._done and self.release is not None:
+            self.release(conn)
+        else:
+            conn.close()
+
+
+class _Writer:
+    def __init__(self, write):
+        self.write = write
+
+
+def connect(server, port, database, uid, pwd, login_timeout=None, timeout=None):
+    """
+    login_timeout - ожидание подключения, timeout - ограничение времени
+    выполнения запроса (statement_timeout), в секундах, как у соединений ODBC
+    """
+    # Сервер перекодирует данные COPY в UTF-8 (TextDecoder) независимо от кодировки базы
+    kwargs = dict(host=server, port=port, dbname=database, user=uid, password=pwd, client_encoding='utf8')
+    if login_timeout:
+        kwargs['connect_timeout'] = int(login_timeout)
+    if timeout:
+        kwargs['options'] = '-c statement_timeout={}'.format(int(timeout * 1000))
+    if psycopg is not None:
+        return psycopg.connect(autocommit=True, **kwargs)
+    conn = psycopg2.connect(**kwargs)
+    conn.autocommit = True
+    return conn
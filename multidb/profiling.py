@@ -0,0 +1,174 @@
+"""
+Профилирование выполнения запроса.
+
+Для каждого этапа (разбор, проверка, СДНФ, запросы к каталогу,
+выполнение запроса на источнике, выгрузка, загрузка в SQLite,
+создание представления, чтение результата) сохраняется время,
+количество строк и объем переданных данных с разбивкой по источникам.
+Профиль можно выгрузить в JSON или в формат Chrome trace (chrome://tracing)
+"""
+import json
+import threading
+import time
+
+
+def estimate_size(rows):
+    """
+    Примерный объем данных в байтах: длина строк и 8 байт на число
+    """
+    size = 0
+    for row in rows:
+        for value in row:
+            if value is None:
+                continue
+            elif isinstance(value, (str, bytes)):
+                size += len(value)
+            else:
+                size += 8
+    return size
+
+
+class Stage:
+    def __init__(self, name, source=None, start=None):
+        self.name = name
+        self.source = source
+        self.start = time.perf_counter() if start is None else start
+        self.duration = 0.0
+        self.rows = None
+        self.bytes = None
+        self.thread = threading.get_ident()
+
+    def add_rows(self, rows, size=None):
+        self.rows = (self.rows or 0) + rows
+        if size is not None:
+            self.bytes = (self.bytes or 0) + size
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'source': self.source,
+            'start': self.start,
+            'duration': self.duration,
+            'rows': self.rows,
+            'bytes': self.bytes,
+        }
+
+    def __repr__(self):
+        return 'Stage({}, source={}, duration={:.6f}, rows={}, bytes={})'.format(
+            self.name, self.source, self.duration, self.rows, self.bytes
+        )
+
+
+class StageTimer:
+    """
+    Контекстный менеджер, добавляющий время выполнения блока к этапу
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stage.duration += time.perf_counter() - self._start
+
+
+class Profile:
+    PARSE = 'parse'
+    VALIDATE = 'validate'
+    PDNF = 'pdnf'
+    CATALOG = 'catalog'
+    EXECUTE = 'remote_execute'
+    FETCH = 'fetch'
+    CREATE = 'sqlite_create'
+    INSERT = 'sqlite_insert'
+    CACHE = 'cache_insert'
+    VIEW = 'view'
+    READ = 'read'
+
+    def __init__(self, count_bytes=False):
+        # Подсчет объема данных требует обхода всех значений,
+        # поэтому включается отдельно
+        self.count_bytes = count_bytes
+        self.origin = time.perf_counter()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def begin(self, name, source=None):
+        stage = Stage(name, source)
+        with self._lock:
+            self.stages.append(stage)
+        return stage
+
+    def stage(self, name, source=None):
+        return StageTimer(self.begin(name, source))
+
+    def size(self, rows):
+        return estimate_size(rows) if self.count_bytes else None
+
+    def summary(self):
+        """
+        Суммарные показатели по этапам с разбивкой по источникам
+        """
+        result = {}
+        for stage in self.stages:
+            total = result.setdefault(stage.name, {'duration': 0.0, 'rows': None, 'bytes': None, 'sources': {}})
+            targets = [total]
+            if stage.source is not None:
+                targets.append(total['sources'].setdefault(
+                    stage.source,
+                    {'duration': 0.0, 'rows': None, 'bytes': None}
+                ))
+            for target in targets:
+                target['duration'] += stage.duration
+                if stage.rows is not None:
+                    target['rows'] = (target['rows'] or 0) + stage.rows
+                if stage.bytes is not None:
+                    target['bytes'] = (target['bytes'] or 0) + stage.bytes
+        return result
+
+    def to_dict(self):
+        return {
+            'stages': [
+                dict(stage.to_dict(), start=stage.start - self.origin)
+                for stage in self.stages
+            ],
+            'summary': self.summary(),
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_chrome_trace(self):
+        events = []
+        for stage in self.stages:
+            args = {
+                key: value
+                for key, value in [('source', stage.source), ('rows', stage.rows), ('bytes', stage.bytes)]
+                if value is not None
+            }
+            events.append({
+                'name': stage.name if stage.source is None else '{} {}'.format(stage.name, stage.source),
+                'cat': stage.name,
+                'ph': 'X',
+                'ts': (stage.start - self.origin) * 1e6,
+                'dur': stage.duration * 1e6,
+                'pid': 0,
+                'tid': stage.thread,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path, fmt='json'):
+        data = self.to_chrome_trace() if fmt == 'chrome' else self.to_dict()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+    def __repr__(self):
+        return 'Profile({})'.format(', '.join(
+            '{}={:.6f}'.format(name, data['duration'])
+            for name, data in self.summary().items()
+        ))
@@ -6,6 +6,7 @@ from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtCore import Qt, QModelIndex
 
 from .import design
+from .. import export
 from ..main import ControlCenter
 import os
 
@@ -13,14 +14,25 @@ PATH_TO_CONFIG = os.environ.get('MULTIDB_CONFIG', 'config.yaml')
 
 
 class TableModel(QtCore.QAbstractTableModel):
-    def __init__(self, data=None, header=None):
-        super(TableModel, self).__init__()
-        self._data = data or []
-        self._header = header or []
+    """
+    Строки результата подгружаются порциями
+    по мере прокрутки таблицы
+    """
 
-    def set_data(self, data, header):
-        self._data = data
-        self._header = header
+    def __init__(self, result=None):
+        super(TableModel, self).__init__()
+        self._result = result
+        self._data = []
+        self._header = result.header if result else []
+
+    def set_result(self, result):
+        self.beginResetModel()
+        if self._result is not None:
+            self._result.close()
+        self._result = result
+        self._data = result.fetchmany()
+        self._header = result.header
+        self.endResetModel()
 
     def data(self, index: QModelIndex, role: int = ...) -> typing.Any:
         if role == Qt.DisplayRole:
@@ -34,9 +46,17 @@ class TableModel(QtCore.QAbstractTableModel):
         return len(self._data)
 
     def columnCount(self, parent: QModelIndex = ...) -> int:
-        # The following takes the first sub-list, and returns
-        # the length (only works if all rows are an equal length)
-        return len(self._data) and len(self._data[0])
+        return len(self._header)
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        return self._result is not None and not self._result.is_exhausted
+
+    def fetchMore(self, parent: QModelIndex) -> None:
+        rows = self._result.fetchmany()
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self._data), len(self._data) + len(rows) - 1)
+            self._data.extend(rows)
+            self.endInsertRows()
 
     def headerData(self, section: int, orientation: Qt.Orientation, role: int = ...) -> typing.Any:
         if role == Qt.DisplayRole and orientation == Qt.Horizontal:
@@ -78,17 +98,33 @@ class MultiDBApp(QtWidgets.QMainWindow, design.Ui_MiltiDB):
 
         self.logInfo.setHtml('######################<br>'.join([text, msg]))
 
+    # Фильтр диалога сохранения -> формат export (None - база SQLite)
+    SAVE_FORMATS = {
+        'SQLite (*.sqlite *.db)': None,
+        'Parquet (*.parquet)': export.PARQUET,
+        'Arrow IPC (*.arrow)': export.ARROW,
+        'CSV (*.csv)': export.CSV,
+    }
+
     def save_result(self):
-        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Выберите папку')
+        path, selected = QtWidgets.QFileDialog.getSaveFileName(
+            self, 'Выберите папку', '', ';;'.join(self.SAVE_FORMATS)
+        )
         if path:
+            kind = self.SAVE_FORMATS.get(selected)
             try:
-                err = self.control_center.save_result(path)
+                if kind is None:
+                    err = self.control_center.save_result(path)
+                else:
+                    err = self.control_center.export_result(path, kind)
             except Exception as ex:
                 err = 'Fatal error save result: {}'.format(str(ex))
             if err:
                 self.log(err, self.ERROR)
-            else:
+            elif kind is None:
                 self.log('Successfully. To view the result, use the following query:\n"SELECT * FROM result;"', self.INFO)
+            else:
+                self.log('Successfully. Result saved to {}'.format(path), self.INFO)
 
     def run_query(self):
         query = self.queryEditor.toPlainText()
@@ -98,8 +134,8 @@ class MultiDBApp(QtWidgets.QMainWindow, design.Ui_MiltiDB):
             err = 'Fatal error run query: {}'.format(str(ex))
             data = None
         if data:
-            create, select, insert, view, sample = data
-            self.model.set_data(*sample)
+            create, select, insert, view, result = data
+            self.model.set_result(result)
             self.queryResult.setModel(self.model)
             print('...')
             print('\n'.join(select))
@@ -120,7 +156,10 @@ def main():
     app = QtWidgets.QApplication(sys.argv)
     windows = MultiDBApp()
     windows.show()
-    app.exec_()
+    try:
+        app.exec_()
+    finally:
+        windows.control_center.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+"""
+Курсор по результату запроса (представление result в SQLite).
+Строки читаются порциями, поэтому в памяти одновременно
+находится не более batch_size строк
+"""
+from . import profiling
+from .profiling import Profile
+
+
+class ResultCursor:
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, ctx, header, batch_size=DEFAULT_BATCH_SIZE, own_context=False, types=None):
+        self.ctx = ctx
+        self.header = header
+        # Базовые типы колонок (BaseDialect), None - тип неизвестен
+        self.types = types or [None] * len(header)
+        self.batch_size = batch_size
+        # Если контекст создан ControlCenter.execute,
+        # то он закрывается вместе с курсором
+        self.own_context = own_context
+
+        self._cursor = None
+        self.row_count = 0
+        self.is_exhausted = False
+
+        # Профиль выполнения запроса, чтение результата
+        # добавляется в него как этап Profile.READ
+        self.profile = ctx.profile
+        self._read_stage = None
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.ctx.sqlite_conn.execute('SELECT * FROM result')
+        return self._cursor
+
+    def fetchmany(self, size=None):
+        if self.is_exhausted:
+            return []
+        size = size or self.batch_size
+        if self._read_stage is None:
+            self._read_stage = self.profile.begin(Profile.READ)
+        with profiling.StageTimer(self._read_stage):
+            rows = self.cursor.fetchmany(size)
+        self._read_stage.add_rows(len(rows), self.profile.size(rows))
+        self.row_count += len(rows)
+        if len(rows) < size:
+            self.is_exhausted = True
+        return rows
+
+    def batches(self):
+        while True:
+            rows = self.fetchmany()
+            if not rows:
+                return
+            yield rows
+
+    def __iter__(self):
+        for rows in self.batches():
+            yield from rows
+
+    def close(self):
+        self.is_exhausted = True
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        if self.own_context:
+            self.ctx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
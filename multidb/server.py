@@ -0,0 +1,222 @@
+"""
+HTTP сервер multidb без графического интерфейса.
+
+Один ControlCenter обслуживает всех клиентов, поэтому пулы соединений
+с источниками, кэш метаданных и кэш выгрузок общие. Каждый запрос
+выполняется в собственном контексте (ControlCenter.session), результат
+передается порциями (Transfer-Encoding: chunked) по мере чтения из SQLite.
+
+    python -m multidb.server --port 8765
+
+    POST /query       тело - текст запроса или JSON {"query": ..., "format": ..., "timeout": ...}
+                      формат ответа (параметр format или ?format=):
+                        jsonl - первая строка {"columns": [...], "types": [...]},
+                                далее строки результата массивами JSON
+                        csv   - заголовок и строки CSV
+                        arrow - Arrow IPC stream (нужен pyarrow)
+    GET  /health      {"status": "ok"}
+
+Ошибка запроса или его параметров возвращается со статусом 400 и телом {"error": ...},
+непредвиденная ошибка до начала ответа - со статусом 500.
+При разрыве соединения клиентом чтение результата прекращается
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import os
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from . import export
+from .main import ControlCenter
+from .result import ResultCursor
+
+CONTENT_TYPES = {
+    export.JSONL: 'application/x-ndjson',
+    export.CSV: 'text/csv; charset=utf-8',
+    export.ARROW: 'application/vnd.apache.arrow.stream',
+}
+
+
+class ChunkedFile(io.RawIOBase):
+    """
+    Файловый объект, записывающий тело ответа порциями chunked encoding
+    """
+
+    def __init__(self, wfile):
+        super().__init__()
+        self.wfile = wfile
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii'))
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+        return len(data)
+
+    def finish(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server_version = 'multidb'
+    protocol_version = 'HTTP/1.1'
+    logger = logging.getLogger('server')
+
+    @property
+    def cc(self) -> ControlCenter:
+        return self.server.cc
+
+    def log_message(self, format, *args):
+        self.logger.info('%s %s', self.address_string(), format % args)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/health':
+            return self._send_json(HTTPStatus.OK, {'status': 'ok'})
+        self._send_json(HTTPStatus.NOT_FOUND, {'error': 'Not found'})
+
+    def do_POST(self):
+        self._headers_sent = False
+        try:
+            self._post()
+        except (BrokenPipeError, ConnectionResetError):
+            self.logger.info('Client %s disconnected', self.address_string())
+            self.close_connection = True
+        except Exception as ex:
+            self.logger.exception('Request %s failed', self.path)
+            if self._headers_sent:
+                # Ответ уже начат, клиент получит оборванный поток
+                self.close_connection = True
+            else:
+                self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(ex)})
+
+    def _post(self):
+        url = urlsplit(self.path)
+        if url.path != '/query':
+            return self._send_json(HTTPStatus.NOT_FOUND, {'error': 'Not found'})
+        err, params = self._params(url)
+        if err:
+            return self._send_json(HTTPStatus.BAD_REQUEST, {'error': err})
+
+        ctx = self.cc.session()
+        try:
+            err, data = self.cc.execute(
+                params['query'],
+                ctx,
+                batch_size=self.server.batch_size,
+                timeout=params['timeout'],
+            )
+            if err:
+                return self._send_json(HTTPStatus.BAD_REQUEST, {'error': err})
+            self._send_result(params['format'], data[-1])
+        finally:
+            ctx.close()
+
+    def _params(self, url):
+        """
+        Параметры запроса из строки запроса и тела: текст ошибки или None
+        и словарь с ключами query, format, timeout
+        """
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode('utf-8')
+        except ValueError as ex:
+            # Непрочитанное тело нельзя отделить от следующего запроса
+            self.close_connection = True
+            return 'Invalid request body: {}'.format(ex), None
+        if self.headers.get_content_type() == 'application/json':
+            try:
+                data = json.loads(body)
+            except ValueError as ex:
+                return 'Invalid JSON: {}'.format(ex), None
+            if not isinstance(data, dict):
+                return 'JSON body must be an object', None
+            params.update(data)
+        else:
+            params['query'] = body
+
+        query = params.get('query') or ''
+        if not isinstance(query, str):
+            return 'Query must be a string', None
+        fmt = params.get('format', export.JSONL)
+        if not isinstance(fmt, str) or fmt not in export.STREAM_WRITERS:
+            return 'Unknown format: {}'.format(fmt), None
+        timeout = params.get('timeout')
+        if timeout in (None, ''):
+            timeout = None
+        else:
+            try:
+                timeout = None if isinstance(timeout, bool) else float(timeout)
+            except (TypeError, ValueError):
+                timeout = None
+            if timeout is None or not 0 < timeout < math.inf:
+                return 'Invalid timeout: {}'.format(params['timeout']), None
+        return None, dict(query=query, format=fmt, timeout=timeout)
+
+    def _send_result(self, fmt, result: ResultCursor):
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', CONTENT_TYPES[fmt])
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        file = ChunkedFile(self.wfile)
+        writer = export.STREAM_WRITERS[fmt](file, result.header, result.types)
+        for rows in result.batches():
+            writer.write(rows)
+        writer.close()
+        file.finish()
+        self.logger.info('%s rows sent\n%s', result.row_count, result.profile.summary())
+
+    def end_headers(self):
+        super().end_headers()
+        self._headers_sent = True
+
+    def _send_json(self, status, value):
+        body = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cc: ControlCenter, batch_size=ResultCursor.DEFAULT_BATCH_SIZE):
+        super().__init__(address, QueryHandler)
+        self.cc = cc
+        self.batch_size = batch_size
+
+    def server_close(self):
+        super().server_close()
+        self.cc.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--config', default=os.environ.get('MULTIDB_CONFIG', 'config.yaml'))
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8765)
+    arg_parser.add_argument('--batch-size', type=int, default=ResultCursor.DEFAULT_BATCH_SIZE)
+    args = arg_parser.parse_args(argv)
+
+    server = Server((args.host, args.port), ControlCenter(args.config), args.batch_size)
+    QueryHandler.logger.info('Listening on %s:%s', *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
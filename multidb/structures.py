@@ -1,54 +1,100 @@
 import logging
+import sqlite3
+import threading
 
 import pyodbc
 import pypika as pk
 from pypika import dialects as pika_dialects
+from pypika import functions as pika_fn
 
+from . import cache
+from . import context
 from . import dialect
+from . import encoding
+from . import files
 from . import mixins as mx
 from .exceptions import SemanticException
+from .profiling import Profile
 from . import utils
 
 
 class DBMS:
     TYPE_TO_DIALECT = {
-        'psql':  dialect.PostgreSQL,
-        'mysql': dialect.MySQL,
+        'psql':   dialect.PostgreSQL,
+        'mysql':  dialect.MySQL,
+        'sqlite': dialect.SQLite,
+        'files':  files.Files,
     }
     TYPE_TO_PIKA = {
-        'psql':  pika_dialects.PostgreSQLQuery,
-        'mysql': pika_dialects.MySQLQuery
+        'psql':   pika_dialects.PostgreSQLQuery,
+        'mysql':  pika_dialects.MySQLQuery,
+        'sqlite': pika_dialects.SQLLiteQuery,
+        'files':  pika_dialects.SQLLiteQuery,
     }
 
+    DEFAULT_STREAM_THRESHOLD = 100000
+
     def __init__(self, name, connect_data):
+        # Пул свободных соединений: (db, stream) -> [connection, ...]
         self.connections = {}
+        self._lock = threading.Lock()
         kind_dbms = connect_data.pop('type').lower()
+        # Время ожидания подключения и выполнения запроса на источнике, в секундах
+        self.login_timeout = connect_data.pop('login_timeout', None)
+        self.timeout = connect_data.pop('timeout', None)
+        # Таблицы, в которых по оценке больше stream_threshold строк,
+        # выгружаются потоково (None - отключено)
+        self.stream_threshold = connect_data.pop('stream_threshold', self.DEFAULT_STREAM_THRESHOLD)
+        # Количество параллельных запросов при выгрузке большой таблицы
+        self.partitions = connect_data.pop('partitions', 1)
+        # Таблицы с инкрементальной выгрузкой: 'db.schema.table' -> cache.Watermark
+        self.incremental = {
+            name: cache.Watermark.from_config(data)
+            for name, data in (connect_data.pop('incremental', None) or {}).items()
+        }
         self.dialect = self.TYPE_TO_DIALECT[kind_dbms](**connect_data)
         self.sql = self.TYPE_TO_PIKA[kind_dbms]
-        self.tables = {}
         self.name = name
 
-    def connect(self, db):
-        conn = self.connections.get(db)
-        if conn is None:
-            self.connections[db] = conn = pyodbc.connect(self.dialect.conn_str(db))
-        return conn
+    def connect(self, db, stream=False):
+        return self.dialect.connect(db, self.login_timeout, self.timeout, stream)
+
+    def acquire(self, db, stream=False):
+        """
+        Берет свободное соединение из пула или создает новое.
+        Потоковые соединения хранятся в пуле отдельно
+        """
+        with self._lock:
+            idle = self.connections.get((db, stream))
+            if idle:
+                return idle.pop()
+        return self.connect(db, stream)
+
+    def release(self, db, conn, stream=False):
+        with self._lock:
+            self.connections.setdefault((db, stream), []).append(conn)
 
     def __del__(self):
-        for conn in self.connections.values():
-            conn.close()
+        for idle in self.connections.values():
+            for conn in idle:
+                conn.close()
 
 
 class Table:
-    IS_SQLITE = False
-    count = 0
     logger = logging.getLogger('table')
 
-    def __init__(self, dbms: DBMS, db: str, schema: str, table: str):
+    def __init__(self, dbms: DBMS, db: str, schema: str, table: str, ctx: context.QueryContext = None):
+        self.context = ctx or context.current()
         self.dbms = dbms
-        self.connection = dbms.connect(db)
+        self.connection = self.context.connect(dbms, db)
         self.cursor: pyodbc.Cursor = self.connection.cursor()
-        dbms.tables.setdefault(db, {}).setdefault(schema, {})[table] = self
+        # Дополнительные соединения для выгрузки: [(connection, cursor), ...]
+        self._connections = []
+        # Курсоры с результатами запросов данных (dialect.execute),
+        # могут не совпадать с курсорами соединений
+        self.extract_cursors = []
+        self._lock = threading.Lock()
+        self.context.tables.append(self)
 
         self.db = db
         self.schema = schema
@@ -58,24 +104,28 @@ class Table:
         self._schema = pk.Schema(schema)
         self._table = pk.Table(table, self._schema, query_cls=self.dbms.sql)
 
-        self.sqlite_table = pk.Table('{}_{}'.format(table, Table.count))
+        self.sqlite_table = pk.Table('{}_{}'.format(table, self.context.table_count))
 
-        self.indexes = self.dbms.dialect.get_indexes(self.cursor, schema, table)
-        self.columns, self.name_to_column = self.__get_columns()
+        with self.context.profile.stage(Profile.CATALOG, self.source_name):
+            self.indexes = self.dbms.dialect.get_indexes(self.cursor, schema, table)
+            self.name_to_column = self.__get_columns()
 
-        try:
-            self.test_table(self.cursor)
-        except Exception as ex:
-            msg = 'Table {}.{}.{} not found:\nException:{}'.format(db, schema, table, ex)
-            self.logger.error(msg)
-            raise SemanticException(msg)
+            try:
+                self.test_table(self.cursor)
+            except Exception as ex:
+                msg = 'Table {}.{}.{} not found:\nException:{}'.format(db, schema, table, ex)
+                self.logger.error(msg)
+                raise SemanticException(msg)
 
         self.filters = []
+        # Индексы закодированных колонок в selected_columns (encoding.encode),
+        # None - еще не выбраны
+        self.encoded_idx = None
 
-        Table.count += 1
+        self.context.next_table_number()
 
     def get_sql(self):
-        return self.sqlite_table.get_sql() if Table.IS_SQLITE else self._table.get_sql()
+        return self.sqlite_table.get_sql() if self.context.is_sqlite else self._table.get_sql()
 
     def __get_columns(self):
         raw_columns = self.dbms.dialect.all_columns(self.cursor, self.schema, self.table)
@@ -83,20 +133,25 @@ class Table:
             msg = 'Columns not found for table {}.{}.{}'.format(self.db, self.schema, self.table)
             self.logger.error(msg)
             raise SemanticException(msg)
-        columns = []
-        name_to_column = {}
-        for column_name, is_null, dtype, max_len, max_size, supported in raw_columns:
-            found_indexes = []
-            for index in self.indexes:
-                for idx_column in index.columns:
-                    if column_name == idx_column.name:
-                        found_indexes.append(index)
-                        break
-
-            column = Column(self, column_name, is_null, dtype, max_len, max_size, found_indexes, supported)
-            columns.append(column)
-            name_to_column[column_name] = column
-        return columns, name_to_column
+        return ColumnCatalog(self, raw_columns)
+
+    @property
+    def columns(self):
+        """
+        Все колонки таблицы (создаются объекты для всех колонок)
+        """
+        return list(self.name_to_column)
+
+    @utils.lazy_property
+    def index_map(self):
+        """
+        Имя колонки -> индексы, в которые она входит
+        """
+        result = {}
+        for index in self.indexes:
+            for name in dict.fromkeys(idx_column.name for idx_column in index.columns):
+                result.setdefault(name, []).append(index)
+        return result
 
     def test_table(self, cursor):
         query = (self.dbms.sql
@@ -106,26 +161,180 @@ class Table:
         cursor.execute(query.get_sql())
         cursor.fetchall()
 
+    @utils.lazy_property
+    def estimate(self):
+        """
+        Оценка запроса select_query источником (dialect.Estimate)
+        """
+        with self.context.profile.stage(Profile.CATALOG, self.source_name):
+            return self.dbms.dialect.estimate(self.cursor, self.db, self.select_query.get_sql())
+
+    @utils.lazy_property
+    def estimated_rows(self):
+        if self.estimate is not None and self.estimate.rows is not None:
+            return self.estimate.rows
+        with self.context.profile.stage(Profile.CATALOG, self.source_name):
+            return self.dbms.dialect.row_count(self.cursor, self.schema, self.table)
+
+    @utils.lazy_property
+    def watermark(self):
+        """
+        Водяной знак для инкрементальной выгрузки через кэш (cache.Watermark)
+        """
+        watermark = self.dbms.incremental.get('.'.join(self.full_name()[1:]))
+        if watermark is None or self.context.cc is None:
+            return None
+        column = self.name_to_column.get(watermark.column)
+        if column is None or not column.supported:
+            self.logger.error(
+                'Watermark column %s not found or not supported in %s',
+                watermark.column,
+                self.source_name
+            )
+            return None
+        return watermark
+
+    @utils.lazy_property
+    def streaming(self):
+        """
+        Выгружать таблицу потоково: порциями через соединение
+        без буферизации результата на клиенте
+        """
+        threshold = self.dbms.stream_threshold
+        if threshold is None:
+            return False
+        rows = self.estimated_rows
+        return rows is not None and rows > threshold
+
+    def open_cursor(self, stream=False):
+        """
+        Курсор на отдельном соединении из пула
+        """
+        connection = self.context.connect(self.dbms, self.db, stream)
+        cursor = connection.cursor()
+        with self._lock:
+            self._connections.append((connection, cursor))
+        return cursor
+
+    def extract_cursor(self):
+        """
+        Курсор для запроса данных: большие таблицы выгружаются
+        через отдельное потоковое соединение
+        """
+        if self.streaming and self.dbms.dialect.STREAM_OPTIONS:
+            return self.open_cursor(stream=True)
+        return self.cursor
+
+    def execute(self, select_query, cursor=None):
+        cursor = self.dbms.dialect.execute(cursor or self.extract_cursor(), self, select_query)
+        self.register_cursor(cursor)
+        return cursor
+
+    def register_cursor(self, cursor):
+        """
+        Курсор с результатом запроса данных, прерываемый cancel и закрываемый close.
+        Диалект может зарегистрировать курсор до начала выполнения запроса
+        """
+        with self._lock:
+            if all(cursor is not c for c in self.extract_cursors):
+                self.extract_cursors.append(cursor)
+
+    @utils.lazy_property
+    def partition_key(self):
+        """
+        Целочисленная колонка, первая в индексе (уникальные индексы
+        предпочтительнее), по которой таблицу можно разбить на диапазоны
+        """
+        for index in sorted(self.indexes, key=lambda index: not index.is_unique):
+            column = self.name_to_column.get(index.columns[0].name)
+            if column is not None and column.dtype in (dialect.BaseDialect.INT, dialect.BaseDialect.LONG):
+                return column
+        return None
+
+    @utils.lazy_property
+    def partitions(self):
+        """
+        Запросы данных для параллельной выгрузки большой таблицы:
+        select_query с непересекающимися условиями key BETWEEN a AND b
+        (и key IS NULL). None, если таблица выгружается одним запросом
+        """
+        count = self.dbms.partitions
+        key = self.partition_key
+        if count <= 1 or not self.dbms.dialect.PARTITIONED or key is None or not self.streaming:
+            return None
+
+        field = pk.Field(key.name)
+        query = self._table.select(pika_fn.Min(field), pika_fn.Max(field))
+        for f in self.filters:
+            query = query.where(f.pika())
+        with self.context.profile.stage(Profile.CATALOG, self.source_name):
+            self.cursor.execute(query.get_sql())
+            low, high = self.cursor.fetchone()
+        if low is None:
+            return None
+
+        step = -(-(high - low + 1) // count)
+        queries = [
+            self.select_query.where(field[start:min(start + step - 1, high)])
+            for start in range(low, high + 1, step)
+        ]
+        if key.is_null:
+            queries.append(self.select_query.where(field.isnull()))
+        return [query.get_sql() for query in queries]
+
     @utils.lazy_property
     def selected_columns(self):
+        # Используемые колонки всегда созданы, остальные не перебираются
         columns = [
             column
-            for column in self.columns
+            for column in self.name_to_column.created()
             if column.used and (column.visible or column.count_used > 0)
         ]
         for i, column in enumerate(columns):
             column.idx = i
         return columns
 
+    def __cursors(self):
+        with self._lock:
+            connections = [(self.connection, self.cursor)] + self._connections
+            cursors = [cursor for _, cursor in connections]
+            extract_cursors = [
+                cursor
+                for cursor in self.extract_cursors
+                if all(cursor is not c for c in cursors)
+            ]
+        return connections, extract_cursors
+
+    def close(self):
+        connections, extract_cursors = self.__cursors()
+        for cursor in extract_cursors:
+            cursor.close()
+        for _, cursor in connections:
+            try:
+                cursor.close()
+            except (pyodbc.ProgrammingError, sqlite3.ProgrammingError):
+                pass
+
+    def cancel(self):
+        """
+        Прерывает выполняемые на источнике запросы
+        """
+        connections, extract_cursors = self.__cursors()
+        for cursor in extract_cursors:
+            cursor.cancel()
+        for connection, cursor in connections:
+            self.dbms.dialect.cancel(connection, cursor)
+
     def __del__(self):
-        try:
-            self.cursor.close()
-        except pyodbc.ProgrammingError:
-            pass
+        self.close()
 
     def full_name(self):
         return self.dbms.name, self.db, self.schema, self.table
 
+    @property
+    def source_name(self):
+        return '.'.join(self.full_name())
+
     @utils.lazy_property
     def select_query(self):
         q = self._table.select(*[
@@ -144,6 +353,16 @@ class Table:
         ])
         return pk.SQLLiteQuery.create_table(self.sqlite_table).columns(*columns)
 
+    def staging_create_query(self):
+        """
+        create_query с целым типом закодированных колонок
+        """
+        columns = pk.Columns(*[
+            (column.name, 'integer' if column.encoded else column.type)
+            for column in self.selected_columns
+        ])
+        return pk.SQLLiteQuery.create_table(self.sqlite_table).columns(*columns).get_sql()
+
     @utils.lazy_property
     def insert_query(self):
         return 'INSERT INTO {} VALUES ({})'.format(
@@ -159,6 +378,59 @@ class Table:
         return 'Table({}.{}.{}.{}, where={})'.format(*self.full_name(), self.filters)
 
 
+class ColumnCatalog:
+    """
+    Колонки таблицы: name -> Column. Описания колонок из каталога источника
+    хранятся как есть, объект Column создается при первом обращении к колонке,
+    поэтому для широких таблиц разбор запроса зависит от количества
+    используемых колонок, а не от ширины таблицы
+    """
+
+    def __init__(self, table: Table, raw_columns):
+        self.table = table
+        # name -> (порядковый номер, описание колонки из dialect.all_columns)
+        self._raw = {raw[0]: (i, raw) for i, raw in enumerate(raw_columns)}
+        self._columns = {}
+
+    def get(self, name, default=None):
+        column = self._columns.get(name)
+        if column is None:
+            found = self._raw.get(name)
+            if found is None:
+                return default
+            _, (column_name, is_null, dtype, max_len, max_size, supported) = found
+            column = self._columns[name] = Column(
+                self.table, column_name, is_null, dtype, max_len, max_size,
+                self.table.index_map.get(column_name), supported
+            )
+        return column
+
+    def __getitem__(self, name):
+        column = self.get(name)
+        if column is None:
+            raise KeyError(name)
+        return column
+
+    def __contains__(self, name):
+        return name in self._raw
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __iter__(self):
+        for name in self._raw:
+            yield self.get(name)
+
+    def names(self):
+        return list(self._raw)
+
+    def created(self):
+        """
+        Уже созданные колонки в порядке колонок таблицы
+        """
+        return sorted(self._columns.values(), key=lambda column: self._raw[column.name][0])
+
+
 class Column(mx.AsMixin):
 
     def __init__(self, table: Table, name: str, is_null: bool, dtype: str,
@@ -175,6 +447,8 @@ class Column(mx.AsMixin):
         self.max_size = max_size  # max_len * 4 for unicode
 
         self.supported = supported
+        # Значения хранятся в SQLite в виде кодов словаря (encoding)
+        self.encoded = False
 
         self._used = False
         self.visible = False
@@ -189,7 +463,16 @@ class Column(mx.AsMixin):
                 dialect.BaseDialect.BASE_TYPE_TO_SQLITE_TYPE[self.dtype])
 
     def pika(self):
-        return pk.Field(self.name, table=self.table.sqlite_table) if Table.IS_SQLITE else pk.Field(self.name)
+        field = self.code_pika()
+        if self.encoded and self.table.context.is_sqlite:
+            return encoding.Decode(field, self.name)
+        return field
+
+    def code_pika(self):
+        """
+        Колонка без декодирования: для закодированной колонки в SQLite - код значения
+        """
+        return pk.Field(self.name, table=self.table.sqlite_table) if self.table.context.is_sqlite else pk.Field(self.name)
 
     @property
     def used(self):
@@ -1,5 +1,6 @@
 import ast
 import re
+import sys
 from datetime import datetime
 
 from . import keywords as kw
@@ -19,23 +20,21 @@ class BaseToken:
     SYMBOL = 7
     END = 8
 
+    __slots__ = ('raw_value', 'interval', '_decode')
+
     kind = None
     regexp = None
 
     @classmethod
     def match(cls, pos):
-        match = cls.regexp.match(pos.text)
-        return (match.end(), match) if match else (0, None)
+        match = cls.regexp.match(pos.source, pos.idx)
+        return (match.end() - pos.idx, match) if match else (0, None)
 
     def __init__(self, match, interval):
-        self.match = match
+        self.raw_value = match.group() if match else None
         self.interval = interval
 
-    @utils.lazy_property
-    def raw_value(self):
-        return self.match.group()
-
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
         raise NotImplementedError(
             'Необходимо определить метод decode в {}'.format(self.__class__.__name__)
@@ -52,37 +51,45 @@ class BaseToken:
 
 
 class IntToken(BaseToken):
+    __slots__ = ()
+
     kind = BaseToken.INT
     regexp = re.compile(r'(?:[1-9]\d*|0)(?![0-9A-Za-z_])')
 
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
-        return int(super().raw_value)
+        return int(self.raw_value)
 
 
 class FloatToken(BaseToken):
+    __slots__ = ()
+
     kind = BaseToken.FLOAT
     regexp = re.compile(r'(?:([1-9]\d*|0)?\.\d+|([1-9]\d*|0)\.)(?![0-9A-Za-z_])')
 
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
         return float(self.raw_value)
 
 
 class StringToken(BaseToken):
+    __slots__ = ()
+
     kind = BaseToken.STRING
     regexp = re.compile(r'\'([^\\\']|\\.)*\'')
 
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
-        return ast.literal_eval(self.raw_value())
+        return ast.literal_eval(self.raw_value)
 
 
 class DateToken(StringToken):
+    __slots__ = ()
+
     kind = BaseToken.DATE
     regexp = re.compile(r'\'\d{4}-\d{2}-\d{2}\'')
 
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
         str_date = super().decode
         try:
@@ -92,10 +99,12 @@ class DateToken(StringToken):
 
 
 class DatetimeToken(StringToken):
+    __slots__ = ()
+
     kind = BaseToken.DATETIME
     regexp = re.compile(r'\'\d{4}-\d{2}-\d{2} \d{2}-\d{2}-\d{2}\'')
 
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
         str_date = super().decode
         try:
@@ -105,57 +114,77 @@ class DatetimeToken(StringToken):
 
 
 class IdentifierToken(BaseToken):
+    __slots__ = ()
+
     kind = BaseToken.IDENTIFIER
     regexp = re.compile(r'[a-zA-Z_][a-zA-Z_0-9]*|`[a-zA-Z_][a-zA-Z_0-9]*`')
 
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
         return self.raw_value.strip('`')
 
 
 class PSQLIdentifierToken(BaseToken):
+    __slots__ = ()
+
     kind = BaseToken.IDENTIFIER
     regexp = re.compile(r'[a-zA-Z_][a-zA-Z_0-9]*|"[a-zA-Z_][a-zA-Z_0-9]*"')
 
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
         return self.raw_value.strip('"')
 
 
 class KeywordToken(IdentifierToken):
+    __slots__ = ('is_reserved',)
+
     kind = BaseToken.KEYWORD
 
     RESERVED_WORDS = kw.RESERVED_WORDS
     NON_RESERVED_WORDS = kw.NON_RESERVED_WORDS
+    # Написание ключевого слова в запросе -> (ключевое слово, is_reserved).
+    # Для всех токенов одного ключевого слова используется одна строка
+    INTERNED = {}
+
+    @classmethod
+    def keyword(cls, raw_value):
+        """
+        (ключевое слово, is_reserved) или None, если raw_value не ключевое слово
+        """
+        try:
+            return cls.INTERNED[raw_value]
+        except KeyError:
+            pass
+        value = raw_value.strip('`').upper()
+        if value not in cls.RESERVED_WORDS and value not in cls.NON_RESERVED_WORDS:
+            return None
+        data = cls.INTERNED[raw_value] = sys.intern(value), value in cls.RESERVED_WORDS
+        return data
 
     @classmethod
     def match(cls, pos):
         size, match = super().match(pos)
-        if match:
-            val = match.group().upper()
-            if val in cls.RESERVED_WORDS or val in cls.NON_RESERVED_WORDS:
-                return size, match
+        if match and cls.keyword(match.group()):
+            return size, match
         return 0, None
 
     def __init__(self, match, interval):
         super().__init__(match, interval)
-        self.is_reserved = self.decode in self.RESERVED_WORDS
-
-    @utils.lazy_property
-    def decode(self):
-        return super().decode.upper()
+        self._decode, self.is_reserved = self.keyword(self.raw_value)
 
     def check_type(self, other):
         return (self.decode == other) if isinstance(other, str) else super().check_type(other)
 
 
 class SymbolToken(BaseToken):
+    __slots__ = ()
+
     kind = BaseToken.SYMBOL
     NAME_TO_SYMBOL = ss.NAME_TO_SYMBOL
     SYMBOL_TO_NAME = ss.SYMBOL_TO_NAME
     regexp = re.compile(r'|'.join(re.escape(s) for n, s in ss.SPEC_SYMBOLS))
 
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
         return self.SYMBOL_TO_NAME[self.raw_value]
 
@@ -164,16 +193,14 @@ class SymbolToken(BaseToken):
 
 
 class EndToken(BaseToken):
+    __slots__ = ()
+
     kind = BaseToken.END
 
     def __init__(self, match=None, interval=None):
         super().__init__(match, interval)
 
-    @utils.lazy_property
-    def raw_value(self):
-        return None
-
-    @utils.lazy_property
+    @utils.slot_property
     def decode(self):
         return None
 
@@ -1,5 +1,7 @@
 import logging
+import os
 from functools import wraps
+from . import context
 from . import mixins
 
 
@@ -16,9 +18,36 @@ class lazy_property:
         return result
 
 
+# noinspection PyPep8Naming
+class slot_property:
+    """
+    lazy_property для классов с __slots__:
+    значение сохраняется в слоте _<имя функции>
+    """
+
+    def __init__(self, func):
+        self._func = func
+        self._slot = '_' + func.__name__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self._slot)
+        except AttributeError:
+            result = self._func(instance)
+            setattr(instance, self._slot, result)
+            return result
+
+
 # noinspection PyPep8Naming
 class log:
-    size = 0
+    """
+    Трассировка вызовов правил парсера.
+    Включается переменной окружения MULTIDB_TRACE до импорта модулей,
+    в выключенном состоянии декоратор возвращает исходную функцию
+    """
+    enabled = os.getenv('MULTIDB_TRACE', '').lower() in ('1', 'true', 'yes')
     step = 2
 
     def __init__(self, logger=logging, level=logging.DEBUG, name=None):
@@ -27,21 +56,33 @@ class log:
         self.name = name
 
     def __call__(self, func):
+        if not log.enabled:
+            return func
+
+        logger = self.logger
+        level = self.level
+        name = func.__name__ if self.name is None else self.name
+
         @wraps(func)
         def new_func(*args, **kwargs):
-            self.logger.log(self.level, '%s> %s', ' ' * log.size, func.__name__ if self.name is None else self.name)
-            log.size += log.step
+            if not logger.isEnabledFor(level):
+                return func(*args, **kwargs)
+            ctx = context.current()
+            logger.log(level, '%s> %s', ' ' * ctx.log_size, name)
+            ctx.log_size += log.step
             try:
                 out = func(*args, **kwargs)
             finally:
-                log.size -= log.step
-                self.logger.log(self.level, '%s< %s', ' ' * log.size, func.__name__ if self.name is None else self.name)
+                ctx.log_size -= log.step
+                logger.log(level, '%s< %s', ' ' * ctx.log_size, name)
             return out
 
         return new_func
 
 
 class NamingChain(mixins.AsMixin):
+    __slots__ = ('chain',)
+
     def __init__(self, *args):
         super().__init__()
         self.chain = list(args)
@@ -16,6 +16,10 @@ setup(
         'pyqt5==5.13.0',
         'PyYAML'
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+        'copy': ['psycopg'],
+    },
     url='',
     license='',
     author='Chugunov Denis',
@@ -0,0 +1,55 @@
+"""
+Повторное использование выгрузок (extract_ttl) при кодировании строковых колонок словарем
+"""
+import shutil
+import tempfile
+import unittest
+
+from multidb.bench import sources
+
+
+class ExtractCacheTest(unittest.TestCase):
+    QUERY = "SELECT t.id, t.c1 FROM bench.db0.main.t0 AS t WHERE t.c1 <> 'value 3'"
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        sources.make_tables(self.path, 1, 2000, 3, 0.5, 1)
+        self.cc = sources.make_control_center(self.path)
+        self.cc.extract_ttl = 600
+        self.cc.dictionary_ratio = 0.5
+
+    def tearDown(self):
+        self.cc.close()
+        shutil.rmtree(self.path)
+
+    def execute(self):
+        err, data = self.cc.execute(self.QUERY)
+        self.assertIsNone(err)
+        result = data[-1]
+        try:
+            return sorted(result)
+        finally:
+            result.close()
+
+    def test_encoded_filter_hits_extract(self):
+        loads = []
+        load_extract = self.cc.cache.load_extract
+
+        def spy(*args):
+            loads.append(load_extract(*args))
+            return loads[-1]
+
+        self.cc.cache.load_extract = spy
+        first = self.execute()
+        second = self.execute()
+
+        self.assertEqual(first, second)
+        self.assertIsNone(loads[0])
+        self.assertIsNotNone(loads[1])
+        # Сигнатура выгрузки - исходное условие, без кодов словаря
+        filters, = self.cc.cache.conn.execute('SELECT filters FROM multidb_extracts').fetchone()
+        self.assertNotIn('multidb_dict', filters)
+
+
+if __name__ == '__main__':
+    unittest.main()